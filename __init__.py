@@ -45,6 +45,27 @@ if "bpy" in locals():
     if "mixamoconv" in locals():
         reload(mixamoconv)
 
+def update_preview(self, context):
+    """rebuilds the root motion preview with the changed options"""
+    preview = mixamoconv.get_preview()
+    if preview is None:
+        return
+    armature = bpy.data.objects.get(preview[mixamoconv.PREVIEW_PROPERTY])
+    if armature is None:
+        mixamoconv.remove_preview()
+        return
+    try:
+        mixamoconv.create_preview(armature, use_x=self.use_x, use_y=self.use_y, use_z=self.use_z, on_ground=self.on_ground,
+                                  use_rotation=self.use_rotation, restoffset=self.restoffset, hipname=self.hipname)
+    except ValueError:
+        mixamoconv.remove_preview()
+
+def scene_range(context):
+    """frame range of the scene if only it is to be converted, else None"""
+    if not context.scene.mixamo.use_scene_range:
+        return None
+    return (context.scene.frame_start, context.scene.frame_end)
+
 class MixamoPropertyGroup(bpy.types.PropertyGroup):
     '''Property container for options and paths of mixamo Converter'''
     advanced: bpy.props.BoolProperty(
@@ -63,24 +84,29 @@ class MixamoPropertyGroup(bpy.types.PropertyGroup):
     use_x: bpy.props.BoolProperty(
         name="Use X",
         description="If enabled, Horizontal motion is transfered to RootBone",
-        default=True)
+        default=True,
+        update=update_preview)
     use_y: bpy.props.BoolProperty(
         name="Use Y",
         description="If enabled, Horizontal motion is transfered to RootBone",
-        default=True)
+        default=True,
+        update=update_preview)
     use_z: bpy.props.BoolProperty(
         name="Use Z",
         description="If enabled, vertical motion is transfered to RootBone",
-        default=True)
+        default=True,
+        update=update_preview)
     on_ground: bpy.props.BoolProperty(
         name="On Ground",
         description="If enabled, root bone is on ground and only moves up at jumps",
-        default=True)
+        default=True,
+        update=update_preview)
 
     use_rotation: bpy.props.BoolProperty(
         name="Transfer Rotation",
         description="Whether to transfer roation to root motion. Should be enabled for curve walking animations. Can be disabled for straight animations with strong hip Motion like Rolling",
-        default=True)
+        default=True,
+        update=update_preview)
 
     scale: bpy.props.FloatProperty(
         name="Scale",
@@ -89,7 +115,8 @@ class MixamoPropertyGroup(bpy.types.PropertyGroup):
     restoffset: bpy.props.FloatVectorProperty(
         name="Restpose Offset",
         description="Offset restpose by this. Use to correct if origin is not on ground",
-        default=(0.0, 0.0, 0.0))
+        default=(0.0, 0.0, 0.0),
+        update=update_preview)
     knee_offset: bpy.props.FloatVectorProperty(
         name="Knee Offset",
         description="Offset knee joints by this. Use to fix flipping legs.",
@@ -112,10 +139,42 @@ class MixamoPropertyGroup(bpy.types.PropertyGroup):
         maxlen = 256,
         default = "",
         subtype='DIR_PATH')
+    recursive: bpy.props.BoolProperty(
+        name="Include Subfolders",
+        description="If enabled, also converts files in subfolders of the input path and mirrors the folders in the output path",
+        default=False)
+    include: bpy.props.StringProperty(
+        name="Include",
+        description="Only convert files whose path or name matches one of these glob patterns. Seperate patterns with commas.",
+        maxlen = 256,
+        default = "*",
+        subtype='NONE')
+    exclude: bpy.props.StringProperty(
+        name="Exclude",
+        description="Skip files and folders whose path or name matches one of these glob patterns. Seperate patterns with commas.",
+        maxlen = 256,
+        default = "",
+        subtype='NONE')
     add_leaf_bones: bpy.props.BoolProperty(
         name="Add Leaf Bones",
         description="If enabled, adds leaf bones on export when batchconverting",
         default=False)
+    anim_only: bpy.props.BoolProperty(
+        name="Animation Only",
+        description="If enabled, exports only the armature and its animation without meshes, materials and textures when batchconverting",
+        default=False)
+    write_index: bpy.props.BoolProperty(
+        name="Write Clip Index",
+        description="If enabled, writes frame range, root displacement, speed, turn angle and looping of all converted clips to clip_index.json/.npz in the output path",
+        default=False)
+    skip_duplicates: bpy.props.BoolProperty(
+        name="Skip Duplicates",
+        description="If enabled, converts clips with the same motion only once and hard links (or copies) the converted file for the others. The groups are listed in duplicates.json in the output path",
+        default=False)
+    write_telemetry: bpy.props.BoolProperty(
+        name="Write Telemetry",
+        description="If enabled, writes timings of every conversion stage per file to telemetry.jsonl and a run summary to telemetry_summary.json in the output path",
+        default=False)
     outpath: bpy.props.StringProperty(
         name="Output Path",
         description="Where Processed rigs should be saved to",
@@ -126,6 +185,14 @@ class MixamoPropertyGroup(bpy.types.PropertyGroup):
         name="Ignore Leaf Bones",
         description="Ignore leaf bones on import",
         default=False)
+    archives: bpy.props.BoolProperty(
+        name="Read Zip Archives",
+        description="If enabled, also converts the FBX and Collada files inside zip archives in the input path without extracting them to disk. The folders inside an archive are kept below a folder named like the archive",
+        default=False)
+    stream_collada: bpy.props.BoolProperty(
+        name="Streaming Collada Reader",
+        description="Reads only skeleton and animation of Collada files with a fast, memory saving reader. Bones keep the orientation of the Collada joints",
+        default=False)
     automatic_bone_orientation: bpy.props.BoolProperty(
         name="Automatic Bone Orientation",
         description="Try to align the major bone axis with the bone children",
@@ -136,7 +203,8 @@ class MixamoPropertyGroup(bpy.types.PropertyGroup):
         description="Additional Hipname to search for if not MixamoRig",
         maxlen = 256,
         default = "",
-        subtype='NONE')
+        subtype='NONE',
+        update=update_preview)
     b_remove_namespace: bpy.props.BoolProperty(
         name="Remove Namespace",
         description="Removes Naespaces from objects and bones",
@@ -169,6 +237,32 @@ class MixamoPropertyGroup(bpy.types.PropertyGroup):
         name="Foot Bone Workaround",
         description="Attempts to fix twisting of the foot bones",
         default=False)
+    target_fps: bpy.props.IntProperty(
+        name="Target FPS",
+        description="Resamples the converted animation to this frame rate. 0 keeps the frame rate of the source",
+        default=0,
+        min=0)
+    chunk_size: bpy.props.IntProperty(
+        name="Chunk Size",
+        description="Bakes very long clips in windows of this many frames, which bounds the per frame buffers of each bake but not the keys of the whole clip. 0 bakes the whole clip at once",
+        default=0,
+        min=0)
+    mirror: bpy.props.BoolProperty(
+        name="Mirror",
+        description="Also creates a left/right mirrored copy of the converted animation. Batch conversion exports it as <name>_mirror.fbx",
+        default=False)
+    use_scene_range: bpy.props.BoolProperty(
+        name="Scene Frame Range",
+        description="Only converts the frames from the start to the end frame of the scene",
+        default=False)
+    split_markers: bpy.props.BoolProperty(
+        name="Split at Markers",
+        description="Splits the converted animation into one action per marker, running up to the next marker. Single conversion uses the timeline markers, or else the markers of the action. Batch conversion uses a json file of named frame ranges next to each file, or else the markers of its action, and exports every clip as <name>_<marker>.fbx",
+        default=False)
+    use_cache: bpy.props.BoolProperty(
+        name="Cache Bakes",
+        description="Reuses baked helper curves from previous conversions if the animation and options did not change",
+        default=False)
 
 
 class OBJECT_OT_RemoveNamespace(bpy.types.Operator):
@@ -222,6 +316,8 @@ class OBJECT_OT_ConvertSingle(bpy.types.Operator):
             self.report({'ERROR_INVALID_INPUT'}, "Error: %s is not an Armature." % bpy.context.object.name)
             return{ 'CANCELLED'}
 
+        # the preview is replaced by the baked root motion
+        mixamoconv.remove_preview(bpy.context.object)
         mixamoconv_iterator = mixamoconv.hip_to_root(
             armature = bpy.context.object,
             use_x = mixamo.use_x,
@@ -237,7 +333,13 @@ class OBJECT_OT_ConvertSingle(bpy.types.Operator):
             apply_scale = mixamo.apply_scale,
             quaternion_clean_pre=mixamo.quaternion_clean_pre,
             quaternion_clean_post=mixamo.quaternion_clean_post,
-            foot_bone_workaround=mixamo.foot_bone_workaround)
+            foot_bone_workaround=mixamo.foot_bone_workaround,
+            use_cache=mixamo.use_cache,
+            target_fps=mixamo.target_fps,
+            chunk_size=mixamo.chunk_size,
+            mirror=mixamo.mirror,
+            frame_range=scene_range(context),
+            clips=mixamoconv.marker_clips(bpy.context.object, context.scene.timeline_markers) if mixamo.split_markers else None)
 
         try:
             for status in mixamoconv_iterator:
@@ -251,6 +353,39 @@ class OBJECT_OT_ConvertSingle(bpy.types.Operator):
         return{ 'FINISHED'}
 
 
+class OBJECT_OT_PreviewRootMotion(bpy.types.Operator):
+    '''Button/Operator for toggling the root motion preview'''
+    bl_idname = "mixamo.preview_rootmotion"
+    bl_label = "Preview Root Motion"
+    bl_description = "Shows the root motion that would be baked as a live empty which follows option changes. Nothing is baked until Convert Single"
+
+    def execute(self, context):
+        mixamo = context.scene.mixamo
+        if mixamoconv.get_preview() is not None:
+            mixamoconv.remove_preview()
+            return{ 'FINISHED'}
+        if bpy.context.object == None:
+            self.report({'ERROR_INVALID_INPUT'}, "Error: no object selected. Please select the Armature object.")
+            return{ 'CANCELLED'}
+        if bpy.context.object.type != 'ARMATURE':
+            self.report({'ERROR_INVALID_INPUT'}, "Error: %s is not an Armature." % bpy.context.object.name)
+            return{ 'CANCELLED'}
+        try:
+            mixamoconv.create_preview(
+                bpy.context.object,
+                use_x = mixamo.use_x,
+                use_y = mixamo.use_y,
+                use_z = mixamo.use_z,
+                on_ground = mixamo.on_ground,
+                use_rotation = mixamo.use_rotation,
+                restoffset = mixamo.restoffset,
+                hipname = mixamo.hipname)
+        except ValueError as e:
+            self.report({'ERROR_INVALID_INPUT'}, 'Error: ' + str(e))
+            return{ 'CANCELLED'}
+        return{ 'FINISHED'}
+
+
 class OBJECT_OT_ConvertSingleStepwise(bpy.types.Operator):
     '''Button/Operator for converting single Rig'''
     bl_idname = "mixamo.convertsingle_stepwise"
@@ -270,6 +405,7 @@ class OBJECT_OT_ConvertSingleStepwise(bpy.types.Operator):
             if bpy.context.object.type != 'ARMATURE':
                 self.report({'ERROR_INVALID_INPUT'}, "Error: %s is not an Armature." % bpy.context.object.name)
                 return{ 'CANCELLED'}
+            mixamoconv.remove_preview(bpy.context.object)
             bpy._mixamoconv_iterator = mixamoconv.hip_to_root(
                 armature = bpy.context.object,
                 use_x = mixamo.use_x,
@@ -285,7 +421,13 @@ class OBJECT_OT_ConvertSingleStepwise(bpy.types.Operator):
                 apply_scale = mixamo.apply_scale,
                 quaternion_clean_pre=mixamo.quaternion_clean_pre,
                 quaternion_clean_post=mixamo.quaternion_clean_post,
-                foot_bone_workaround=mixamo.foot_bone_workaround)
+                foot_bone_workaround=mixamo.foot_bone_workaround,
+                use_cache=mixamo.use_cache,
+                target_fps=mixamo.target_fps,
+                chunk_size=mixamo.chunk_size,
+                mirror=mixamo.mirror,
+                frame_range=scene_range(context),
+                clips=mixamoconv.marker_clips(bpy.context.object, context.scene.timeline_markers) if mixamo.split_markers else None)
             self.report({'INFO'}, "New conversion started")
         try:
             try:
@@ -371,7 +513,21 @@ class OBJECT_OT_ConvertBatch(bpy.types.Operator):
             automatic_bone_orientation = mixamo.automatic_bone_orientation,
             quaternion_clean_pre=mixamo.quaternion_clean_pre,
             quaternion_clean_post=mixamo.quaternion_clean_post,
-            foot_bone_workaround=mixamo.foot_bone_workaround)
+            foot_bone_workaround=mixamo.foot_bone_workaround,
+            write_index=mixamo.write_index,
+            telemetry_dir=bpy.path.abspath(outpath) if mixamo.write_telemetry else None,
+            deduplicate='link' if mixamo.skip_duplicates else None,
+            target_fps=mixamo.target_fps,
+            chunk_size=mixamo.chunk_size,
+            mirror=mixamo.mirror,
+            frame_range=scene_range(context),
+            split_clips=mixamo.split_markers,
+            anim_only=mixamo.anim_only,
+            stream_collada=mixamo.stream_collada,
+            recursive=mixamo.recursive,
+            archives=mixamo.archives,
+            include=[pattern.strip() for pattern in mixamo.include.split(',') if pattern.strip()] or ['*'],
+            exclude=[pattern.strip() for pattern in mixamo.exclude.split(',') if pattern.strip()])
         if numfiles == -1:
             self.report({'ERROR_INVALID_INPUT'}, 'Error: Not all files could be converted, look in console for more information')
             return{ 'CANCELLED'}
@@ -400,6 +556,8 @@ class MIXAMOCONV_VIEW_3D_PT_mixamoconv(bpy.types.Panel):
             row.prop(scene.mixamo, "on_ground", toggle =True)
         row = box.row()
         row.prop(scene.mixamo, "use_rotation", toggle = True)
+        row = box.row()
+        row.operator("mixamo.preview_rootmotion", icon='HIDE_OFF', depress=mixamoconv.get_preview() is not None)
         # Button for conversion of single Selected rig
         row = box.row()
         row.scale_y = 2.0
@@ -443,6 +601,15 @@ class MIXAMOCONV_VIEW_3D_PT_mixamoconv(bpy.types.Panel):
             if scene.mixamo.apply_scale:
                 row.prop(scene.mixamo, "scale")
 
+            row = box.row()
+            row.prop(scene.mixamo, "target_fps")
+            row.prop(scene.mixamo, "use_cache")
+            row = box.row()
+            row.prop(scene.mixamo, "mirror")
+            row = box.row()
+            row.prop(scene.mixamo, "use_scene_range")
+            row.prop(scene.mixamo, "split_markers")
+
             row = box.row()
             row.prop(scene.mixamo, "experimental", toggle=True, icon='ERROR')
             if scene.mixamo.experimental:
@@ -462,6 +629,7 @@ class MIXAMOCONV_VIEW_3D_PT_mixamoconv(bpy.types.Panel):
 
                 row = box.row()
                 row.prop(scene.mixamo, "foot_bone_workaround")
+                row.prop(scene.mixamo, "chunk_size")
 
         # input and output paths for batch conversion
         box = layout.box()
@@ -474,6 +642,16 @@ class MIXAMOCONV_VIEW_3D_PT_mixamoconv(bpy.types.Panel):
             row = box.row()
             row.prop(scene.mixamo, "ignore_leaf_bones")
             row.prop(scene.mixamo, "automatic_bone_orientation")
+            row = box.row()
+            row.prop(scene.mixamo, "stream_collada")
+            row = box.row()
+            row.prop(scene.mixamo, "recursive")
+            row.prop(scene.mixamo, "archives")
+        # the filters also apply to files directly in the input path, so they are shown whenever they are set
+        if scene.mixamo.advanced or scene.mixamo.include.strip() not in ('', '*') or scene.mixamo.exclude.strip():
+            row = box.row()
+            row.prop(scene.mixamo, "include")
+            row.prop(scene.mixamo, "exclude")
 
         row = box.row()
         row.prop(scene.mixamo, "outpath")
@@ -483,6 +661,12 @@ class MIXAMOCONV_VIEW_3D_PT_mixamoconv(bpy.types.Panel):
             row = box.row()
             row.prop(scene.mixamo, "add_leaf_bones")
             row.prop(scene.mixamo, "force_overwrite")
+            row = box.row()
+            row.prop(scene.mixamo, "anim_only")
+            row.prop(scene.mixamo, "write_index")
+            row = box.row()
+            row.prop(scene.mixamo, "skip_duplicates")
+            row.prop(scene.mixamo, "write_telemetry")
 
 
         # button to start batch conversion
@@ -495,6 +679,7 @@ classes = (
     OBJECT_OT_RemoveNamespace,
     OBJECT_OT_UseBlenderBoneNames,
     OBJECT_OT_ConvertSingle,
+    OBJECT_OT_PreviewRootMotion,
     OBJECT_OT_ConvertSingleStepwise,
     OBJECT_OT_ApplyRestoffset,
     OBJECT_OT_ConvertBatch,
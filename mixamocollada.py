@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Copyright (C) 2017-2021  Enzio Probst
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+# Streaming reader for the skeleton and animation of mixamo Collada files.
+#
+# The file is read twice with iterparse and every element is dropped as soon as it is used: the first pass reads
+# the joint hierarchy, the second turns one animation channel at a time into fcurves. Meshes are skipped, so
+# only the armature and its action are created. Bones keep the axes of the Collada joints.
+
+from xml.etree.ElementTree import iterparse
+from math import radians
+import logging
+import numpy as np
+import bpy
+from mathutils import Matrix
+
+try:
+    from . import mixamokernels
+except ImportError:
+    import mixamokernels
+
+log = logging.getLogger(__name__)
+
+
+def local_tag(element):
+    return element.tag.rsplit('}', 1)[-1]
+
+
+def parse_floats(text):
+    return np.fromstring(text or '', dtype=np.float64, sep=' ')
+
+
+class Joint:
+    '''joint of the Collada skeleton, matrix is relative to the parent joint'''
+    def __init__(self, node_id, name, parent):
+        self.node_id = node_id
+        self.name = name
+        self.parent = parent
+        self.matrix = np.identity(4)
+
+
+def read_skeleton(filepath):
+    """first pass: returns the up axis, the joints in hierarchy order and the world matrix of the nodes above the root joints"""
+    up_axis = 'Y_UP'
+    joints = []
+    # stack of (joint index or None, world matrix of non joint node or None) for the open <node> elements
+    stack = []
+    root_matrix = None
+    in_scene = False
+    for event, element in iterparse(str(filepath), events=('start', 'end')):
+        tag = local_tag(element)
+        if event == 'start':
+            if tag == 'library_visual_scenes':
+                in_scene = True
+            elif tag == 'node' and in_scene:
+                parent_joint = next((j for j, _ in reversed(stack) if j is not None), None)
+                if element.get('type') == 'JOINT':
+                    joints.append(Joint(element.get('id'), element.get('name') or element.get('id'), parent_joint))
+                    stack.append((len(joints) - 1, None))
+                else:
+                    parent_matrix = stack[-1][1] if stack and stack[-1][1] is not None else np.identity(4)
+                    stack.append((None, parent_matrix.copy()))
+            continue
+
+        if tag == 'up_axis':
+            up_axis = (element.text or up_axis).strip()
+        elif in_scene and stack and tag in ('matrix', 'translate', 'rotate', 'scale'):
+            values = parse_floats(element.text)
+            if tag == 'matrix':
+                transform = values.reshape(4, 4)
+            elif tag == 'translate':
+                transform = np.identity(4)
+                transform[:3, 3] = values
+            elif tag == 'rotate':
+                transform = mixamokernels.axis_angle_matrix(values[:3], radians(values[3]))
+            else:
+                transform = np.diag((values[0], values[1], values[2], 1.0))
+            joint_index, node_matrix = stack[-1]
+            if joint_index is not None:
+                joints[joint_index].matrix = joints[joint_index].matrix @ transform
+            else:
+                stack[-1] = (None, node_matrix @ transform)
+        elif tag == 'node' and in_scene:
+            joint_index, node_matrix = stack.pop()
+            if joint_index is not None and joints[joint_index].parent is None and root_matrix is None:
+                root_matrix = next((m for j, m in reversed(stack) if m is not None), np.identity(4))
+        elif tag == 'library_visual_scenes':
+            break
+        element.clear()
+    if root_matrix is None:
+        root_matrix = np.identity(4)
+    return up_axis, joints, root_matrix
+
+
+def build_armature(joints, name='Armature'):
+    """creates an armature object from joints, bones point along the Y axis of their joints"""
+    world = []
+    for joint in joints:
+        world.append(joint.matrix if joint.parent is None else world[joint.parent] @ joint.matrix)
+    children = {}
+    for index, joint in enumerate(joints):
+        if joint.parent is not None:
+            children.setdefault(joint.parent, []).append(index)
+
+    data = bpy.data.armatures.new(name)
+    armature = bpy.data.objects.new(name, data)
+    bpy.context.scene.collection.objects.link(armature)
+    bpy.context.view_layer.objects.active = armature
+    bpy.ops.object.mode_set(mode='EDIT')
+    edit_bones = []
+    for index, joint in enumerate(joints):
+        edit_bone = data.edit_bones.new(joint.name)
+        edit_bone.head = (0.0, 0.0, 0.0)
+        edit_bone.tail = (0.0, 1.0, 0.0)
+        edit_bone.matrix = Matrix(world[index].tolist())
+        lengths = [np.linalg.norm(world[child][:3, 3] - world[index][:3, 3]) for child in children.get(index, ())]
+        length = max(lengths) if lengths else 0.0
+        if length < 1e-4:
+            length = edit_bones[joint.parent].length * 0.5 if joint.parent is not None else 1.0
+        edit_bone.length = length
+        if joint.parent is not None:
+            edit_bone.parent = edit_bones[joint.parent]
+        edit_bones.append(edit_bone)
+    bpy.ops.object.mode_set(mode='OBJECT')
+    for pose_bone in armature.pose.bones:
+        pose_bone.rotation_mode = 'QUATERNION'
+    return armature
+
+
+def set_keys(action, data_path, index, group, frames, values):
+    fcurve = action.fcurves.new(data_path, index=index, action_group=group)
+    fcurve.keyframe_points.add(len(frames))
+    fcurve.keyframe_points.foreach_set('co', np.stack((frames, values), axis=1).astype(np.float32).ravel())
+    fcurve.update()
+
+
+def read_animation(filepath, armature, joints):
+    """second pass: turns every transform channel into location and quaternion fcurves of the matching bone, returns the fps"""
+    joint_by_id = {joint.node_id: joint for joint in joints}
+    action = bpy.data.actions.new(armature.name + 'Action')
+    armature.animation_data_create()
+    armature.animation_data.action = action
+    fps = None
+    current_array = None
+    sources = {}
+    samplers = {}
+    in_animations = False
+    for event, element in iterparse(str(filepath), events=('start', 'end')):
+        tag = local_tag(element)
+        if event == 'start':
+            if tag == 'library_animations':
+                in_animations = True
+            elif tag == 'source':
+                current_array = None
+            continue
+        if not in_animations:
+            # nothing outside of the animations is needed in this pass
+            element.clear()
+            continue
+        if tag == 'float_array':
+            current_array = parse_floats(element.text)
+        elif tag == 'source':
+            if current_array is not None:
+                sources['#' + element.get('id')] = current_array
+            current_array = None
+        elif tag == 'sampler':
+            inputs = {child.get('semantic'): child.get('source') for child in element if local_tag(child) == 'input'}
+            samplers['#' + element.get('id')] = (inputs.get('INPUT'), inputs.get('OUTPUT'))
+        elif tag == 'channel':
+            node_id, _, target = element.get('target', '').partition('/')
+            input_id, output_id = samplers.pop(element.get('source'), (None, None))
+            times = sources.pop(input_id, None)
+            values = sources.pop(output_id, None)
+            joint = joint_by_id.get(node_id)
+            if joint is None or times is None or values is None or len(values) != len(times) * 16:
+                log.warning('WARNING skipping unsupported animation channel %s', element.get('target'))
+            else:
+                if fps is None and len(times) > 1:
+                    fps = max(1, int(round(1.0 / np.median(np.diff(times)))))
+                frames = 1.0 + times * (fps or 30)
+                basis = np.linalg.inv(joint.matrix) @ values.reshape(-1, 4, 4)
+                location = basis[:, :3, 3]
+                rotation = mixamokernels.make_continuous(mixamokernels.matrix_to_quaternion(basis))
+                base_path = 'pose.bones["%s"].' % joint.name
+                for i in range(3):
+                    set_keys(action, base_path + 'location', i, joint.name, frames, location[:, i])
+                for i in range(4):
+                    set_keys(action, base_path + 'rotation_quaternion', i, joint.name, frames, rotation[:, i])
+        elif tag == 'animation':
+            sources.clear()
+            samplers.clear()
+        elif tag == 'library_animations':
+            break
+        else:
+            continue
+        element.clear()
+    return fps
+
+
+def import_collada(filepath, name='Armature'):
+    """imports skeleton and animation of a Collada file, the armature is selected and active afterwards"""
+    up_axis, joints, root_matrix = read_skeleton(filepath)
+    if not joints:
+        raise TypeError("No Armature found")
+    armature = build_armature(joints, name)
+    fps = read_animation(filepath, armature, joints)
+    if fps is not None:
+        bpy.context.scene.render.fps = fps
+        bpy.context.scene.render.fps_base = 1.0
+
+    # nodes above the skeleton and the up axis end up in the object transform
+    axis_fix = np.identity(4)
+    if up_axis == 'Y_UP':
+        axis_fix = mixamokernels.axis_angle_matrix(np.array((1.0, 0.0, 0.0)), radians(90.0))
+    elif up_axis == 'X_UP':
+        axis_fix = mixamokernels.axis_angle_matrix(np.array((0.0, 1.0, 0.0)), radians(-90.0))
+    armature.matrix_world = Matrix((axis_fix @ root_matrix).tolist())
+
+    bpy.ops.object.select_all(action='DESELECT')
+    armature.select_set(True)
+    bpy.context.view_layer.objects.active = armature
+    return armature
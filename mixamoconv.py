@@ -20,13 +20,32 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
-from pathlib import Path
+from pathlib import Path, PurePosixPath
+from collections import OrderedDict
+from contextlib import contextmanager
+from fnmatch import fnmatch
+import os
 import re
+import shutil
+import tempfile
+import zipfile
+import json
+import hashlib
 import logging
+import numpy as np
 import bpy
 from bpy_types import Object
 from math import pi
-from mathutils import Vector, Quaternion
+from mathutils import Vector
+
+try:
+    from . import mixamocollada
+    from . import mixamokernels
+    from . import mixamotelemetry
+except ImportError:
+    import mixamocollada
+    import mixamokernels
+    import mixamotelemetry
 
 log = logging.getLogger(__name__)
 #log.setLevel('DEBUG')
@@ -50,65 +69,66 @@ def remove_namespace(s=''):
     return -1
 
 
+UNREAL_BONES = {
+    'root': 'Root',
+    'Hips': 'Pelvis',
+    'Spine': 'spine_01',
+    'Spine1': 'spine_02',
+    'Spine2': 'spine_03',
+    'LeftShoulder': 'clavicle_l',
+    'LeftArm': 'upperarm_l',
+    'LeftForeArm': 'lowerarm_l',
+    'LeftHand': 'hand_l',
+    'RightShoulder': 'clavicle_r',
+    'RightArm': 'upperarm_r',
+    'RightForeArm': 'lowerarm_r',
+    'RightHand': 'hand_r',
+    'Neck1': 'neck_01',
+    'Neck': 'neck_01',
+    'Head': 'head',
+    'LeftUpLeg': 'thigh_l',
+    'LeftLeg': 'calf_l',
+    'LeftFoot': 'foot_l',
+    'RightUpLeg': 'thigh_r',
+    'RightLeg': 'calf_r',
+    'RightFoot': 'foot_r',
+    'LeftHandIndex1': 'index_01_l',
+    'LeftHandIndex2': 'index_02_l',
+    'LeftHandIndex3': 'index_03_l',
+    'LeftHandMiddle1': 'middle_01_l',
+    'LeftHandMiddle2': 'middle_02_l',
+    'LeftHandMiddle3': 'middle_03_l',
+    'LeftHandPinky1': 'pinky_01_l',
+    'LeftHandPinky2': 'pinky_02_l',
+    'LeftHandPinky3': 'pinky_03_l',
+    'LeftHandRing1': 'ring_01_l',
+    'LeftHandRing2': 'ring_02_l',
+    'LeftHandRing3': 'ring_03_l',
+    'LeftHandThumb1': 'thumb_01_l',
+    'LeftHandThumb2': 'thumb_02_l',
+    'LeftHandThumb3': 'thumb_03_l',
+    'RightHandIndex1': 'index_01_r',
+    'RightHandIndex2': 'index_02_r',
+    'RightHandIndex3': 'index_03_r',
+    'RightHandMiddle1': 'middle_01_r',
+    'RightHandMiddle2': 'middle_02_r',
+    'RightHandMiddle3': 'middle_03_r',
+    'RightHandPinky1': 'pinky_01_r',
+    'RightHandPinky2': 'pinky_02_r',
+    'RightHandPinky3': 'pinky_03_r',
+    'RightHandRing1': 'ring_01_r',
+    'RightHandRing2': 'ring_02_r',
+    'RightHandRing3': 'ring_03_r',
+    'RightHandThumb1': 'thumb_01_r',
+    'RightHandThumb2': 'thumb_02_r',
+    'RightHandThumb3': 'thumb_03_r',
+    'LeftToeBase': 'ball_l',
+    'RightToeBase': 'ball_r'
+}
+
 def rename_bones(s='', t='unreal'):
     """function for renaming the armature bones to a target skeleton"""
-    unreal = {
-        'root': 'Root',
-        'Hips': 'Pelvis',
-        'Spine': 'spine_01',
-        'Spine1': 'spine_02',
-        'Spine2': 'spine_03',
-        'LeftShoulder': 'clavicle_l',
-        'LeftArm': 'upperarm_l',
-        'LeftForeArm': 'lowerarm_l',
-        'LeftHand': 'hand_l',
-        'RightShoulder': 'clavicle_r',
-        'RightArm': 'upperarm_r',
-        'RightForeArm': 'lowerarm_r',
-        'RightHand': 'hand_r',
-        'Neck1': 'neck_01',
-        'Neck': 'neck_01',
-        'Head': 'head',
-        'LeftUpLeg': 'thigh_l',
-        'LeftLeg': 'calf_l',
-        'LeftFoot': 'foot_l',
-        'RightUpLeg': 'thigh_r',
-        'RightLeg': 'calf_r',
-        'RightFoot': 'foot_r',
-        'LeftHandIndex1': 'index_01_l',
-        'LeftHandIndex2': 'index_02_l',
-        'LeftHandIndex3': 'index_03_l',
-        'LeftHandMiddle1': 'middle_01_l',
-        'LeftHandMiddle2': 'middle_02_l',
-        'LeftHandMiddle3': 'middle_03_l',
-        'LeftHandPinky1': 'pinky_01_l',
-        'LeftHandPinky2': 'pinky_02_l',
-        'LeftHandPinky3': 'pinky_03_l',
-        'LeftHandRing1': 'ring_01_l',
-        'LeftHandRing2': 'ring_02_l',
-        'LeftHandRing3': 'ring_03_l',
-        'LeftHandThumb1': 'thumb_01_l',
-        'LeftHandThumb2': 'thumb_02_l',
-        'LeftHandThumb3': 'thumb_03_l',
-        'RightHandIndex1': 'index_01_r',
-        'RightHandIndex2': 'index_02_r',
-        'RightHandIndex3': 'index_03_r',
-        'RightHandMiddle1': 'middle_01_r',
-        'RightHandMiddle2': 'middle_02_r',
-        'RightHandMiddle3': 'middle_03_r',
-        'RightHandPinky1': 'pinky_01_r',
-        'RightHandPinky2': 'pinky_02_r',
-        'RightHandPinky3': 'pinky_03_r',
-        'RightHandRing1': 'ring_01_r',
-        'RightHandRing2': 'ring_02_r',
-        'RightHandRing3': 'ring_03_r',
-        'RightHandThumb1': 'thumb_01_r',
-        'RightHandThumb2': 'thumb_02_r',
-        'RightHandThumb3': 'thumb_03_r',
-        'LeftToeBase': 'ball_l',
-        'RightToeBase': 'ball_r'
-    }
-    schema = {'unreal': unreal }
+    schema = {'unreal': UNREAL_BONES }
     if type(s) == str:
         i = schema[t].get(s)
         if i:
@@ -146,18 +166,23 @@ def apply_restoffset(armature, hipbone, restoffset):
     bpy.ops.object.mode_set(mode='OBJECT')
 
     # apply restoffset to animation of hip
-    restoffset_local = (restoffset[0], restoffset[2], -restoffset[1])
+    correction = mixamokernels.restoffset_correction(restoffset, armature.scale.x)
     for axis in range(3):
         fcurve = armature.animation_data.action.fcurves.find("pose.bones[\"" + hipbone.name + "\"].location", index=axis)
-        for pi in range(len(fcurve.keyframe_points)):
-            fcurve.keyframe_points[pi].co.y -= restoffset_local[axis] / armature.scale.x
+        co = np.empty(len(fcurve.keyframe_points) * 2, dtype=np.float32)
+        fcurve.keyframe_points.foreach_get('co', co)
+        co[1::2] += correction[axis]
+        fcurve.keyframe_points.foreach_set('co', co)
     return 1
 
 
-def apply_kneefix(armature, offset, bonenames=['RightUpLeg', 'LeftUpLeg']):
-    """workaround for flickering knees after export (moves joints in restpose by offset, can break animation)"""
-    if bpy.context.scene.mixamo.b_unreal_bones:
-        bonenames = ["calf_r", "calf_l"]
+def apply_kneefix(armature, offset, bonenames=None):
+    """workaround for flickering knees after export (moves joints in restpose by offset, can break animation)
+
+    Without bonenames, the knee bones of the naming selected in the scene are used.
+    """
+    if bonenames is None:
+        bonenames = ["calf_r", "calf_l"] if bpy.context.scene.mixamo.b_unreal_bones else ['RightUpLeg', 'LeftUpLeg']
 
     bpy.context.view_layer.objects.active = armature
     bpy.ops.object.mode_set(mode='EDIT')
@@ -180,54 +205,402 @@ def get_all_quaternion_curves(object):
                 yield (fcurves.find(data_path, index=0), fcurves.find(data_path, index=1),fcurves.find(data_path, index=2),fcurves.find(data_path, index=3))
 
 def quaternion_cleanup(object, prevent_flips=True, prevent_inverts=True):
-    """fixes signs in quaternion fcurves swapping from one frame to another"""
+    """fixes signs in quaternion fcurves swapping from one frame to another
+
+    The keyframes are fixed by mixamokernels.quaternion_continuity.
+    """
     for curves in get_all_quaternion_curves(object):
         start = int(min((curves[i].keyframe_points[0].co.x for i in range(4))))
         end = int(max((curves[i].keyframe_points[-1].co.x for i in range(4))))
         for curve in curves:
             for i in range(start, end):
                 curve.keyframe_points.insert(i, curve.evaluate(i)).interpolation = 'LINEAR'
-        zipped = list(zip(
-            curves[0].keyframe_points,
-            curves[1].keyframe_points,
-            curves[2].keyframe_points,
-            curves[3].keyframe_points))
-        for i in range(1, len(zipped)):
-            if prevent_flips:
-                rot_prev = Quaternion((zipped[i-1][j].co.y for j in range(4)))
-                rot_cur = Quaternion((zipped[i][j].co.y for j in range(4)))
-                diff = rot_prev.rotation_difference(rot_cur)
-                if abs(diff.angle - pi) < 0.5:
-                    rot_cur.rotate(Quaternion(diff.axis, pi))
-                    for j in range(4):
-                        zipped[i][j].co.y = rot_cur[j]
-            if prevent_inverts:
-                change_amount = 0.0
-                for j in range(4):
-                    change_amount += abs(zipped[i-1][j].co.y - zipped[i][j].co.y)
-                if change_amount > 1.0:
-                    for j in range(4):
-                        zipped[i][j].co.y *= -1.0
-
-def apply_foot_bone_workaround(armature, bonenames=['RightToeBase', 'LeftToeBase']):
-    """workaround for the twisting of the foot bones in some skeletons"""
-    if bpy.context.scene.mixamo.b_unreal_bones:
-        bonenames = ["ball_r", "ball_l"]
+        count = min(len(curve.keyframe_points) for curve in curves)
+        keys = []
+        for curve in curves:
+            co = np.empty(len(curve.keyframe_points) * 2, dtype=np.float32)
+            curve.keyframe_points.foreach_get('co', co)
+            keys.append(co.reshape(-1, 2))
+        quaternions = np.stack([co[:count, 1] for co in keys], axis=1)
+        quaternions = mixamokernels.quaternion_continuity(quaternions, prevent_flips, prevent_inverts)
+        for curve, co, values in zip(curves, keys, quaternions.T):
+            co[:count, 1] = values
+            curve.keyframe_points.foreach_set('co', co.ravel())
+
+def apply_foot_bone_workaround(armature, bonenames=None):
+    """workaround for the twisting of the foot bones in some skeletons
+
+    Without bonenames, the toe bones of the naming selected in the scene are used.
+    """
+    if bonenames is None:
+        bonenames = ["ball_r", "ball_l"] if bpy.context.scene.mixamo.b_unreal_bones else ['RightToeBase', 'LeftToeBase']
 
     bpy.ops.object.mode_set(mode='EDIT')
     for name in bonenames:
         armature.data.edit_bones[name].roll = pi
 
 class Status:
-    def __init__(self, msg, status_type='default'):
+    def __init__(self, msg, status_type='default', stage=None):
         self.msg = msg
         self.status_type = status_type
+        # fixed name of the step for telemetry, msg may contain values of the clip
+        self.stage = msg if stage is None else stage
     def __str__(self):
         return str(self.msg)
 
+class StageCache:
+    '''size-bounded LRU cache for the baked helper curves of hip_to_root stages
+
+    Entries are the keyframe coordinates and interpolation of the helper action, see read_action_curves
+    and read_action_interpolation.
+    '''
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+    def get(self, key):
+        curves = self.entries.get(key)
+        if curves is not None:
+            self.entries.move_to_end(key)
+        return curves
+    def put(self, key, curves):
+        self.entries[key] = curves
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+    def clear(self):
+        self.entries.clear()
+
+stage_cache = StageCache()
+
+def read_action_curves(action):
+    """returns the keyframe coordinates of all fcurves of action as {(data_path, index): array of shape (n, 2)}"""
+    curves = {}
+    for fcurve in action.fcurves:
+        co = np.empty(len(fcurve.keyframe_points) * 2, dtype=np.float32)
+        fcurve.keyframe_points.foreach_get('co', co)
+        curves[(fcurve.data_path, fcurve.array_index)] = co.reshape(-1, 2)
+    return curves
+
+def read_action_interpolation(action):
+    """returns the interpolation of all keyframes of action as {(data_path, index): list of interpolation modes}"""
+    return {(fcurve.data_path, fcurve.array_index): [key.interpolation for key in fcurve.keyframe_points]
+            for fcurve in action.fcurves}
+
+def write_action_curves(obj, curves, name='Action', interpolation=None):
+    """creates a new action for obj from keyframe coordinates as returned by read_action_curves
+
+    interpolation as returned by read_action_interpolation restores the interpolation of the keyframes,
+    which otherwise is the default of new keyframes.
+    """
+    if obj.animation_data is None:
+        obj.animation_data_create()
+    action = bpy.data.actions.new(name=name)
+    for (data_path, index), co in curves.items():
+        fcurve = action.fcurves.new(data_path, index=index)
+        fcurve.keyframe_points.add(len(co))
+        fcurve.keyframe_points.foreach_set('co', co.ravel())
+        if interpolation is not None:
+            for key, mode in zip(fcurve.keyframe_points, interpolation[(data_path, index)]):
+                key.interpolation = mode
+        fcurve.update()
+    obj.animation_data.action = action
+    return action
+
+def set_curve_keys(action, data_path, index, co):
+    """replaces all keyframes of an fcurve of action by the keyframe coordinates co of shape (n, 2)"""
+    fcurve = action.fcurves.find(data_path, index=index)
+    group = ''
+    if fcurve is not None:
+        if fcurve.group is not None:
+            group = fcurve.group.name
+        action.fcurves.remove(fcurve)
+    fcurve = action.fcurves.new(data_path, index=index, action_group=group)
+    fcurve.keyframe_points.add(len(co))
+    fcurve.keyframe_points.foreach_set('co', np.ascontiguousarray(co, dtype=np.float32).ravel())
+    fcurve.update()
+    return fcurve
+
+def resample_action(obj, source_fps, target_fps):
+    """resamples all fcurves of the action of obj from source_fps to target_fps, slerping quaternions and interpolating everything else linearly"""
+    action = obj.animation_data.action
+    curves = read_action_curves(action)
+    start, end = (int(round(f)) for f in action.frame_range)
+    source_frames = np.arange(start, end + 1, dtype=np.float64)
+    new_frames, positions = mixamokernels.resample_frames(start, end, source_fps, target_fps)
+
+    quaternion_paths = set(curves[0].data_path for curves in get_all_quaternion_curves(obj))
+    for data_path in quaternion_paths:
+        quaternions = np.stack([np.interp(source_frames, curves[(data_path, i)][:, 0], curves[(data_path, i)][:, 1])
+                                for i in range(4)], axis=1)
+        resampled = mixamokernels.resample_quaternions(quaternions, positions)
+        for i in range(4):
+            set_curve_keys(action, data_path, i, np.stack((new_frames, resampled[:, i]), axis=1))
+    for (data_path, index), co in curves.items():
+        if data_path in quaternion_paths:
+            continue
+        values = np.interp(start + positions, co[:, 0], co[:, 1])
+        set_curve_keys(action, data_path, index, np.stack((new_frames, values), axis=1))
+    return (start, int(new_frames[-1]))
+
+def prekey_transform(obj, frame_ranges):
+    """keys location and rotation_quaternion of obj at every frame of frame_ranges with their current values
+
+    Needed before baking in chunks: constraints using the own transform (offsets) must see the
+    unbaked values in later chunks instead of the keys baked in earlier ones.
+    """
+    if obj.animation_data is None:
+        obj.animation_data_create()
+    if obj.animation_data.action is None:
+        obj.animation_data.action = bpy.data.actions.new(name=obj.name + "Action")
+    action = obj.animation_data.action
+    frames = np.concatenate([np.arange(int(start), int(end) + 1, dtype=np.float64) for start, end in frame_ranges])
+    for data_path, values in (('location', obj.location), ('rotation_quaternion', obj.rotation_quaternion)):
+        for index in range(len(values)):
+            fcurve = action.fcurves.find(data_path, index=index)
+            if fcurve is None:
+                keys = np.full(len(frames), values[index])
+            else:
+                keys = np.array([fcurve.evaluate(frame) for frame in frames])
+            set_curve_keys(action, data_path, index, np.stack((frames, keys), axis=1))
+
+def bake_chunked(frame_ranges, chunk_size=0, use_current_action=False, bake_types={'OBJECT'}):
+    """bakes the selection over the frame ranges (start, end), with chunk_size > 0 in windows of that many frames
+
+    Several windows are baked into the current action, so objects with constraints using their own transform
+    have to be keyed with prekey_transform first.
+    """
+    if chunk_size <= 0 and len(frame_ranges) == 1:
+        start, end = frame_ranges[0]
+        bpy.ops.nla.bake(frame_start=start, frame_end=end, step=1, only_selected=True, visual_keying=True,
+                         clear_constraints=True, clear_parents=False, use_current_action=use_current_action, bake_types=bake_types)
+        return
+    windows = []
+    for start, end in frame_ranges:
+        start, end = int(start), int(end)
+        size = chunk_size if chunk_size > 0 else end - start + 1
+        windows.extend((chunk_start, min(chunk_start + size - 1, end)) for chunk_start in range(start, end + 1, size))
+    for i, (start, end) in enumerate(windows):
+        bpy.ops.nla.bake(frame_start=start, frame_end=end, step=1, only_selected=True, visual_keying=True,
+                         clear_constraints=i == len(windows) - 1, clear_parents=False, use_current_action=True, bake_types=bake_types)
+
+def trim_action(action, frame_range):
+    """removes all keyframes of action outside of frame_range (start, end), keying the values at its edges first"""
+    for (data_path, index), co in read_action_curves(action).items():
+        if not len(co):
+            continue
+        fcurve = action.fcurves.find(data_path, index=index)
+        edge_values = (fcurve.evaluate(frame_range[0]), fcurve.evaluate(frame_range[1]))
+        trimmed = mixamokernels.trim_keys(co, frame_range, edge_values)
+        if trimmed.shape != co.shape or not np.array_equal(trimmed, co):
+            set_curve_keys(action, data_path, index, trimmed)
+
+CLIP_PROPERTY = 'mixamo_clip'
+
+def split_action(obj, clips):
+    """creates a copy of the action of obj trimmed to the frame range of each clip, given as {name: (start, end)}
+
+    The copies are named <action>_<name> (which blender may shorten or number), kept with a fake user and
+    store the clip name in their CLIP_PROPERTY. Returns them in the order of clips.
+    """
+    action = obj.animation_data.action
+    actions = []
+    for name, frame_range in clips.items():
+        clip_action = action.copy()
+        clip_action.name = action.name + '_' + name
+        clip_action[CLIP_PROPERTY] = name
+        trim_action(clip_action, frame_range)
+        clip_action.use_fake_user = True
+        actions.append(clip_action)
+    return actions
+
+def get_clip_actions():
+    """returns the actions created by split_action as {clip name: action}"""
+    return {action[CLIP_PROPERTY]: action for action in bpy.data.actions if CLIP_PROPERTY in action}
+
+def check_clip_names(clips):
+    """raises ValueError for clip names which can't be used as part of a file name"""
+    for name in clips:
+        if not name or name in ('.', '..') or re.search(r'[\\/:*?"<>|\x00-\x1f]', name):
+            raise ValueError("invalid clip name %r" % name)
+
+def marker_clips(obj, markers=None):
+    """named frame ranges of the action of obj, each running from one marker to the next
+
+    Uses the given markers (e.g. the timeline markers of the scene) or else the pose markers of the action,
+    returns None if there are none.
+    """
+    if obj.animation_data is None or obj.animation_data.action is None:
+        return None
+    action = obj.animation_data.action
+    if not markers:
+        markers = action.pose_markers
+    if not markers:
+        return None
+    return mixamokernels.marker_ranges([(marker.name, marker.frame) for marker in markers], action.frame_range[1])
+
+def stage_key(action, *options):
+    """hashes the curves of action together with the options a stage depends on"""
+    digest = hashlib.sha1()
+    for (data_path, index), co in sorted(read_action_curves(action).items()):
+        digest.update(('%s[%d]' % (data_path, index)).encode())
+        digest.update(co.tobytes())
+    digest.update(repr(options).encode())
+    return digest.hexdigest()
+
+def mirror_pairs(table):
+    """left/right pairs of the source and of the target names of a renaming table"""
+    pairs = {}
+    for name, target in table.items():
+        other = 'Right' + name[4:] if name.startswith('Left') else None
+        if other in table:
+            pairs.update({name: other, other: name, target: table[other], table[other]: target})
+    return pairs
+
+MIRROR_BONES = mirror_pairs(UNREAL_BONES)
+
+def mirror_bone_name(name):
+    """name of the bone on the other side, keeping the namespace, name itself for bones in the middle"""
+    if name in MIRROR_BONES:
+        return MIRROR_BONES[name]
+    base = remove_namespace(name)
+    prefix = name[:len(name) - len(base)]
+    if base in MIRROR_BONES:
+        return prefix + MIRROR_BONES[base]
+    # bones missing in the table, like leaf bones, follow the same patterns
+    for left, right in (('Left', 'Right'), ('Right', 'Left')):
+        if base.startswith(left):
+            return prefix + right + base[len(left):]
+    for left, right in (('_l', '_r'), ('_r', '_l'), ('_L', '_R'), ('_R', '_L')):
+        if name.endswith(left):
+            return name[:-len(left)] + right
+    return name
+
+# channels changing sign when mirroring on the X axis, the same convention as pasting a flipped pose in blender
+MIRROR_NEGATE = {('location', 0), ('rotation_quaternion', 2), ('rotation_quaternion', 3), ('rotation_euler', 1), ('rotation_euler', 2)}
+
+def mirror_action(obj, name=None, action=None):
+    """creates a left/right mirrored copy of action (by default the action of obj) and returns it
+
+    The object channels (the root motion) are mirrored on the X axis of the parent space, bone channels on the
+    local X axis of the bones and swapped with the bone on the other side (see mirror_bone_name). This assumes
+    a symmetric rest pose, as the mixamo rigs have.
+    """
+    if action is None:
+        action = obj.animation_data.action
+    bone_names = set(bone.name for bone in obj.pose.bones) if obj.type == 'ARMATURE' else set()
+    mirrored = bpy.data.actions.new(name=name or action.name + '_mirror')
+    for (data_path, index), co in read_action_curves(action).items():
+        group = ''
+        match = re.match(r'pose\.bones\["(.+)"\]\.(\w+)$', data_path)
+        if match is not None:
+            bone_name, prop = match.groups()
+            other = mirror_bone_name(bone_name)
+            group = other if other in bone_names else bone_name
+            data_path = 'pose.bones["%s"].%s' % (group, prop)
+        else:
+            prop = data_path
+        if (prop, index) in MIRROR_NEGATE:
+            co = co * np.array((1.0, -1.0), dtype=np.float32)
+        fcurve = mirrored.fcurves.new(data_path, index=index, action_group=group)
+        fcurve.keyframe_points.add(len(co))
+        fcurve.keyframe_points.foreach_set('co', np.ascontiguousarray(co).ravel())
+        fcurve.update()
+    return mirrored
+
+def find_hips(armature, hipname=''):
+    """returns the hip pose bone of armature or None"""
+    for name in ('Hips', 'mixamorig:Hips', 'mixamorig_Hips', 'Pelvis', hipname):
+        hips = armature.pose.bones.get(name)
+        if hips != None:
+            return hips
+    return None
+
+def constrain_rootbaker(baker, root, hips, z_offset, use_x=True, use_y=True, use_z=True, on_ground=True, use_rotation=True):
+    """adds the constraints making baker follow the root motion of the hips of root"""
+    if use_z:
+        log.debug("using z")
+        c_copy_z_loc = baker.constraints.new(type='COPY_LOCATION')
+        c_copy_z_loc.name = "Copy Z_Loc"
+        c_copy_z_loc.target = root
+        c_copy_z_loc.subtarget = hips.name
+        c_copy_z_loc.use_x = False
+        c_copy_z_loc.use_y = False
+        c_copy_z_loc.use_z = True
+        c_copy_z_loc.use_offset = True
+        if on_ground:
+            log.debug("using on ground")
+            baker.location[2] = -z_offset
+            c_on_ground = baker.constraints.new(type='LIMIT_LOCATION')
+            c_on_ground.name = "On Ground"
+            c_on_ground.use_min_z = True
+
+
+    c_copy_loc = baker.constraints.new(type='COPY_LOCATION')
+    c_copy_loc.use_x = use_x
+    c_copy_loc.use_y = use_y
+    c_copy_loc.use_z = False
+    c_copy_loc.target = root
+    c_copy_loc.subtarget = hips.name
+
+    c_copy_rot = baker.constraints.new(type='COPY_ROTATION')
+    c_copy_rot.target = root
+    c_copy_rot.subtarget = hips.name
+    c_copy_rot.use_y = False
+    c_copy_rot.use_x = False
+    c_copy_rot.use_z = use_rotation
+
+PREVIEW_PROPERTY = 'mixamo_preview_of'
+
+def create_preview(armature, use_x=True, use_y=True, use_z=True, on_ground=True, use_rotation=True, restoffset=(0, 0, 0), hipname=''):
+    """creates an empty following the root motion hip_to_root would extract from armature live, without baking anything
+
+    The preview follows the armature at its current size, the Scale factor of hip_to_root scales the whole motion
+    (ground level included) about the origin and is not applied.
+    """
+    remove_preview(armature)
+    hips = find_hips(armature, hipname)
+    if hips == None:
+        raise ValueError("no hips found")
+    preview = bpy.data.objects.new(name="rootmotion_preview", object_data=None)
+    preview.rotation_mode = 'QUATERNION'
+    preview.empty_display_type = 'ARROWS'
+    preview.empty_display_size = hips.bone.length
+    preview.hide_render = True
+    preview[PREVIEW_PROPERTY] = armature.name
+    # apply_restoffset moves the hips in restpose by restoffset without moving them in the animation
+    z_offset = (armature.matrix_local @ hips.bone.head)[2] + restoffset[2]
+    constrain_rootbaker(preview, armature, hips, z_offset, use_x, use_y, use_z, on_ground, use_rotation)
+    bpy.context.scene.collection.objects.link(preview)
+    return preview
+
+def get_preview(armature=None):
+    """returns the root motion preview of armature, or any preview if armature is None"""
+    for obj in bpy.data.objects:
+        if PREVIEW_PROPERTY in obj and (armature is None or obj[PREVIEW_PROPERTY] == armature.name):
+            return obj
+    return None
+
+def remove_preview(armature=None):
+    """deletes the root motion preview of armature, or all previews if armature is None"""
+    for obj in list(bpy.data.objects):
+        if PREVIEW_PROPERTY in obj and (armature is None or obj[PREVIEW_PROPERTY] == armature.name):
+            bpy.data.objects.remove(obj, do_unlink=True)
+
 def hip_to_root(armature, use_x=True, use_y=True, use_z=True, on_ground=True, use_rotation=True, scale=1.0, restoffset=(0, 0, 0),
-                hipname='', fixbind=True, apply_rotation=True, apply_scale=False, quaternion_clean_pre=True, quaternion_clean_post=True, foot_bone_workaround=False):
-    """function to bake hipmotion to RootMotion in MixamoRigs"""
+                hipname='', fixbind=True, apply_rotation=True, apply_scale=False, quaternion_clean_pre=True, quaternion_clean_post=True, foot_bone_workaround=False,
+                use_cache=False, target_fps=0, chunk_size=0, mirror=False, frame_range=None, clips=None, foot_bones=None):
+    """function to bake hipmotion to RootMotion in MixamoRigs
+
+    foot_bones are the names of the toe bones for the foot_bone_workaround, by default those of the scene naming.
+
+    With chunk_size > 0 the bakes run in windows of chunk_size frames, which bounds the per frame buffers of
+    each bake on very long clips. The result is the same. The helpers and the armature still hold keys for the
+    whole clip at the same time, and quaternion cleanups always run over the whole clip.
+    With mirror, a mirrored copy of the converted action (see mirror_action) is created next to it.
+    With frame_range (start, end), only these frames are baked and kept. With clips, a dict of named frame
+    ranges, only the frames of the clips are baked and a trimmed copy of the converted action is created
+    for each of them (see split_action). Clip ranges are given in frames of the source frame rate.
+    """
 
     yield Status("starting hip_to_root")
 
@@ -235,11 +608,16 @@ def hip_to_root(armature, use_x=True, use_y=True, use_z=True, on_ground=True, us
     root.name = "root"
     root.rotation_mode = 'QUATERNION'
     framerange = root.animation_data.action.frame_range
+    if clips:
+        bakeranges = mixamokernels.merge_ranges(clips.values())
+    elif frame_range is not None:
+        bakeranges = [(int(frame_range[0]), int(frame_range[1]))]
+    else:
+        bakeranges = [tuple(framerange)]
+    # constraints using the own transform need it keyed when baking in several windows
+    prekey = chunk_size > 0 or len(bakeranges) > 1
 
-    for hipname in ('Hips', 'mixamorig:Hips', 'mixamorig_Hips', 'Pelvis', hipname):
-        hips = root.pose.bones.get(hipname)
-        if hips != None:
-            break
+    hips = find_hips(root, hipname)
     if hips == None:
         log.warning('WARNING I have not found any hip bone for %s and the conversion is stopping here',  root.pose.bones)
         raise ValueError("no hips found")
@@ -263,7 +641,18 @@ def hip_to_root(armature, use_x=True, use_y=True, use_z=True, on_ground=True, us
         yield Status("quaternion clean pre")
 
     if foot_bone_workaround:
-        apply_foot_bone_workaround(armature)
+        apply_foot_bone_workaround(armature, foot_bones)
+
+    # The helpers are keyed on the animation and pose before the restoffset is applied: it moves the hips in
+    # restpose and their keys in opposite directions, so their motion in world space stays the same. Only the
+    # ground level of the rootbaker depends on it.
+    rootbaker_key = None
+    hipsbaker_key = None
+    if use_cache:
+        pose_key = (hips.name, tuple(bakeranges), tuple(map(tuple, root.matrix_basis)), tuple(map(tuple, hips.bone.matrix_local)))
+        ground_offset = restoffset[2] if use_z and on_ground else 0.0
+        rootbaker_key = stage_key(root.animation_data.action, 'rootbaker', pose_key, ground_offset, use_x, use_y, use_z, on_ground, use_rotation)
+        hipsbaker_key = stage_key(root.animation_data.action, 'hipsbaker', pose_key)
 
     # apply restoffset to restpose and correct animation
     apply_restoffset(root, hips, restoffset)
@@ -276,73 +665,71 @@ def hip_to_root(armature, use_x=True, use_y=True, use_z=True, on_ground=True, us
     rootbaker = bpy.data.objects.new(name="rootbaker", object_data=None)
     rootbaker.rotation_mode = 'QUATERNION'
 
-    if use_z:
-        print("using z")
-        c_rootbaker_copy_z_loc = rootbaker.constraints.new(type='COPY_LOCATION')
-        c_rootbaker_copy_z_loc.name = "Copy Z_Loc"
-        c_rootbaker_copy_z_loc.target = root
-        c_rootbaker_copy_z_loc.subtarget = hips.name
-        c_rootbaker_copy_z_loc.use_x = False
-        c_rootbaker_copy_z_loc.use_y = False
-        c_rootbaker_copy_z_loc.use_z = True
-        c_rootbaker_copy_z_loc.use_offset = True
-        if on_ground:
-            print("using on ground")
-            rootbaker.location[2] = -z_offset
-            c_on_ground = rootbaker.constraints.new(type='LIMIT_LOCATION')
-            c_on_ground.name = "On Ground"
-            c_on_ground.use_min_z = True
-
-
-    c_rootbaker_copy_loc = rootbaker.constraints.new(type='COPY_LOCATION')
-    c_rootbaker_copy_loc.use_x = use_x
-    c_rootbaker_copy_loc.use_y = use_y
-    c_rootbaker_copy_loc.use_z = False
-    c_rootbaker_copy_loc.target = root
-    c_rootbaker_copy_loc.subtarget = hips.name
-
-    c_rootbaker_copy_rot = rootbaker.constraints.new(type='COPY_ROTATION')
-    c_rootbaker_copy_rot.target = root
-    c_rootbaker_copy_rot.subtarget = hips.name
-    c_rootbaker_copy_rot.use_y = False
-    c_rootbaker_copy_rot.use_x = False
-    c_rootbaker_copy_rot.use_z = use_rotation
-    bpy.context.scene.collection.objects.link(rootbaker)
-    yield Status("rootbaker created")
-
-    bpy.ops.object.select_all(action='DESELECT')
-    rootbaker.select_set(True)
-    bpy.context.view_layer.objects.active = rootbaker
+    rootbaker_curves = None
+    if use_cache:
+        rootbaker_curves = stage_cache.get(rootbaker_key)
 
-    bpy.ops.nla.bake(frame_start=framerange[0], frame_end=framerange[1], step=1, only_selected=True, visual_keying=True,
-                     clear_constraints=True, clear_parents=False, use_current_action=False, bake_types={'OBJECT'})
-    yield Status("rootbaker baked")
-    quaternion_cleanup(rootbaker)
-    yield Status("rootbaker quat_cleanup")
+    if rootbaker_curves is not None:
+        curves, interpolation = rootbaker_curves
+        write_action_curves(rootbaker, curves, name="rootbakerAction", interpolation=interpolation)
+        bpy.context.scene.collection.objects.link(rootbaker)
+        yield Status("rootbaker restored from cache")
+    else:
+        constrain_rootbaker(rootbaker, root, hips, z_offset, use_x, use_y, use_z, on_ground, use_rotation)
+        bpy.context.scene.collection.objects.link(rootbaker)
+        yield Status("rootbaker created")
+
+        bpy.ops.object.select_all(action='DESELECT')
+        rootbaker.select_set(True)
+        bpy.context.view_layer.objects.active = rootbaker
+
+        if prekey:
+            prekey_transform(rootbaker, bakeranges)
+        bake_chunked(bakeranges, chunk_size, use_current_action=False, bake_types={'OBJECT'})
+        yield Status("rootbaker baked")
+        quaternion_cleanup(rootbaker)
+        yield Status("rootbaker quat_cleanup")
+        if use_cache:
+            stage_cache.put(rootbaker_key, (read_action_curves(rootbaker.animation_data.action),
+                                            read_action_interpolation(rootbaker.animation_data.action)))
 
     # Create helper to bake hipmotion in Worldspace
     hipsbaker = bpy.data.objects.new(name="hipsbaker", object_data=None)
     hipsbaker.rotation_mode = 'QUATERNION'
 
-    c_hipsbaker_copy_loc = hipsbaker.constraints.new(type='COPY_LOCATION')
-    c_hipsbaker_copy_loc.target = root
-    c_hipsbaker_copy_loc.subtarget = hips.name
-
-    c_hipsbaker_copy_rot = hipsbaker.constraints.new(type='COPY_ROTATION')
-    c_hipsbaker_copy_rot.target = root
-    c_hipsbaker_copy_rot.subtarget = hips.name
-    bpy.context.scene.collection.objects.link(hipsbaker)
-    yield Status("hipsbaker created")
+    hipsbaker_curves = None
+    if use_cache:
+        hipsbaker_curves = stage_cache.get(hipsbaker_key)
 
-    bpy.ops.object.select_all(action='DESELECT')
-    hipsbaker.select_set(True)
-    bpy.context.view_layer.objects.active = hipsbaker
-
-    bpy.ops.nla.bake(frame_start=framerange[0], frame_end=framerange[1], step=1, only_selected=True, visual_keying=True,
-                     clear_constraints=True, clear_parents=False, use_current_action=False, bake_types={'OBJECT'})
-    yield Status("hipsbaker baked")
-    quaternion_cleanup(hipsbaker)
-    yield Status("hipsbaker quatClenaup")
+    if hipsbaker_curves is not None:
+        curves, interpolation = hipsbaker_curves
+        write_action_curves(hipsbaker, curves, name="hipsbakerAction", interpolation=interpolation)
+        bpy.context.scene.collection.objects.link(hipsbaker)
+        yield Status("hipsbaker restored from cache")
+    else:
+        c_hipsbaker_copy_loc = hipsbaker.constraints.new(type='COPY_LOCATION')
+        c_hipsbaker_copy_loc.target = root
+        c_hipsbaker_copy_loc.subtarget = hips.name
+
+        c_hipsbaker_copy_rot = hipsbaker.constraints.new(type='COPY_ROTATION')
+        c_hipsbaker_copy_rot.target = root
+        c_hipsbaker_copy_rot.subtarget = hips.name
+        bpy.context.scene.collection.objects.link(hipsbaker)
+        yield Status("hipsbaker created")
+
+        bpy.ops.object.select_all(action='DESELECT')
+        hipsbaker.select_set(True)
+        bpy.context.view_layer.objects.active = hipsbaker
+
+        if prekey:
+            prekey_transform(hipsbaker, bakeranges)
+        bake_chunked(bakeranges, chunk_size, use_current_action=False, bake_types={'OBJECT'})
+        yield Status("hipsbaker baked")
+        quaternion_cleanup(hipsbaker)
+        yield Status("hipsbaker quatClenaup")
+        if use_cache:
+            stage_cache.put(hipsbaker_key, (read_action_curves(hipsbaker.animation_data.action),
+                                            read_action_interpolation(hipsbaker.animation_data.action)))
 
     # select armature
     bpy.ops.object.select_all(action='DESELECT')
@@ -362,8 +749,9 @@ def hip_to_root(armature, use_x=True, use_y=True, use_z=True, on_ground=True, us
     c_root_copy_rot.use_offset = True
     yield Status("root constrained to rootbaker")
 
-    bpy.ops.nla.bake(frame_start=framerange[0], frame_end=framerange[1], step=1, only_selected=True, visual_keying=True,
-                     clear_constraints=True, clear_parents=False, use_current_action=True, bake_types={'OBJECT'})
+    if prekey:
+        prekey_transform(root, bakeranges)
+    bake_chunked(bakeranges, chunk_size, use_current_action=True, bake_types={'OBJECT'})
 
     yield Status("rootbaker baked back")
     quaternion_cleanup(root)
@@ -380,14 +768,42 @@ def hip_to_root(armature, use_x=True, use_y=True, use_z=True, on_ground=True, us
     c_hips_copy_rot.target = hipsbaker
     yield Status("hips constrained to hipsbaker")
 
-    bpy.ops.nla.bake(frame_start=framerange[0], frame_end=framerange[1], step=1, only_selected=True, visual_keying=True,
-                     clear_constraints=True, clear_parents=False, use_current_action=True, bake_types={'POSE'})
+    bake_chunked(bakeranges, chunk_size, use_current_action=True, bake_types={'POSE'})
     bpy.ops.object.mode_set(mode='OBJECT')
     yield Status("hipsbaker baked back")
 
+    # frames outside of the baked ranges still have the hip motion
+    if clips or frame_range is not None:
+        trim_action(root.animation_data.action, (bakeranges[0][0], bakeranges[-1][1]))
+        yield Status("trimmed to %d-%d" % (bakeranges[0][0], bakeranges[-1][1]), stage="trimmed")
+
     if quaternion_clean_post:
         quaternion_cleanup(root)
-        yield Status("root quaternion cleanup")
+        yield Status("root quaternion cleanup", stage="root quaternion clean post")
+
+    # resample to the target frame rate
+    render = bpy.context.scene.render
+    source_fps = render.fps / render.fps_base
+    if target_fps > 0 and abs(target_fps - source_fps) > 1e-3:
+        frame_start, frame_end = resample_action(root, source_fps, target_fps)
+        render.fps = target_fps
+        render.fps_base = 1.0
+        bpy.context.scene.frame_start = frame_start
+        bpy.context.scene.frame_end = frame_end
+        if clips:
+            clips = {name: mixamokernels.resample_range(clip_range, frame_start, source_fps, target_fps)
+                     for name, clip_range in clips.items()}
+        yield Status("resampled to %d fps" % target_fps, stage="resampled")
+
+    clip_actions = []
+    if clips:
+        clip_actions = split_action(root, clips)
+        yield Status("split into %d clips" % len(clips), stage="split into clips")
+
+    if mirror:
+        for action in [root.animation_data.action] + clip_actions:
+            mirror_action(root, action=action).use_fake_user = True
+        yield Status("mirrored action created")
 
     # Delete helpers
     bpy.data.actions.remove(hipsbaker.animation_data.action)
@@ -423,42 +839,506 @@ def hip_to_root(armature, use_x=True, use_y=True, use_z=True, on_ground=True, us
     return 1
 
 
+class ExportProfile:
+    '''export target of a batch conversion: bone naming schema, scale, leaf bones and output directory'''
+    def __init__(self, dest_dir, naming='namespace', scale=1.0, add_leaf_bones=False):
+        # naming is one of 'none' (keep imported names), 'namespace' (remove_namespace) or 'unreal' (rename_bones)
+        if naming not in ('none', 'namespace', 'unreal'):
+            raise ValueError("unknown naming schema %s" % naming)
+        self.dest_dir = Path(dest_dir)
+        self.naming = naming
+        self.scale = scale
+        self.add_leaf_bones = add_leaf_bones
+
+def rename_for_export(objects, naming):
+    """renames objects and armature bones for an export profile, returns the previous names for restore_names"""
+    names = []
+    for obj in objects:
+        bonenames = [bone.name for bone in obj.data.bones] if obj.type == 'ARMATURE' else None
+        names.append((obj, obj.name, bonenames))
+    for obj in objects:
+        if naming == 'namespace':
+            remove_namespace(obj)
+        elif naming == 'unreal':
+            rename_bones(obj, 'unreal')
+    return names
+
+def restore_names(names):
+    """restores object and bone names saved by rename_for_export"""
+    for obj, name, bonenames in names:
+        if bonenames is not None:
+            for bone, bonename in zip(obj.data.bones, bonenames):
+                bone.name = bonename
+        obj.name = name
+
+def export_fbx(filepath, add_leaf_bones=False, global_scale=1.0, anim_only=False):
+    """exports the whole scene to filepath with the settings used for converted rigs
+
+    With anim_only only armatures and meshes (the binddummy keeping the bindpose) are written,
+    without materials or embedded media.
+    """
+    if anim_only:
+        bpy.ops.export_scene.fbx(filepath=str(filepath),
+                                 use_selection=False,
+                                 object_types={'ARMATURE', 'MESH'},
+                                 use_mesh_modifiers=False,
+                                 embed_textures=False,
+                                 path_mode='STRIP',
+                                 apply_unit_scale=False,
+                                 global_scale=global_scale,
+                                 add_leaf_bones=add_leaf_bones,
+                                 axis_forward='-Z',
+                                 axis_up='Y',
+                                 mesh_smooth_type='FACE')
+        return
+    bpy.ops.export_scene.fbx(filepath=str(filepath),
+                             use_selection=False,
+                             apply_unit_scale=False,
+                             global_scale=global_scale,
+                             add_leaf_bones=add_leaf_bones,
+                             axis_forward='-Z',
+                             axis_up='Y',
+                             mesh_smooth_type='FACE')
+
+def export_outputs(source, dest_dir, export_profiles=None, suffix='.fbx', add_leaf_bones=False, anim_only=False):
+    """exports the scene for source to dest_dir, or once per export profile, returns the (directory, suffix) of the written files"""
+    if export_profiles is None:
+        export_fbx(source.output_path(dest_dir, suffix), add_leaf_bones=add_leaf_bones, anim_only=anim_only)
+        return [(dest_dir, suffix)]
+    for profile in export_profiles:
+        names = rename_for_export(list(bpy.context.scene.objects), profile.naming)
+        export_fbx(source.output_path(profile.dest_dir, suffix),
+                   add_leaf_bones=profile.add_leaf_bones, global_scale=profile.scale, anim_only=anim_only)
+        restore_names(names)
+    return [(profile.dest_dir, suffix) for profile in export_profiles]
+
+def strip_to_armature(armature):
+    """deletes all objects except armature and removes the meshes, materials and images left without users"""
+    for obj in list(bpy.context.scene.objects):
+        if obj != armature:
+            bpy.data.objects.remove(obj, do_unlink=True)
+    for mesh in bpy.data.meshes:
+        if mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
+    for material in bpy.data.materials:
+        if material.users == 0:
+            bpy.data.materials.remove(material)
+    for image in bpy.data.images:
+        if image.users == 0:
+            bpy.data.images.remove(image)
+
+
+def sample_curves(curves, data_path, count, frames, default=0.0):
+    """samples count channels of data_path from curves as returned by read_action_curves at frames, returns array of shape (len(frames), count)"""
+    values = np.full((len(frames), count), default, dtype=np.float64)
+    for index in range(count):
+        co = curves.get((data_path, index))
+        if co is not None and len(co):
+            values[:, index] = np.interp(frames, co[:, 0], co[:, 1])
+    return values
+
+def clip_metadata(armature, loop_tolerance=0.05):
+    """computes frame range, root displacement, average speed, turn angle and looping of a converted clip"""
+    action = armature.animation_data.action
+    curves = read_action_curves(action)
+    start, end = (int(round(f)) for f in action.frame_range)
+    frames = np.arange(start, end + 1, dtype=np.float64)
+    fps = bpy.context.scene.render.fps / bpy.context.scene.render.fps_base
+
+    location = sample_curves(curves, 'location', 3, frames)
+    rotation = sample_curves(curves, 'rotation_quaternion', 4, frames)
+    if ('rotation_quaternion', 0) not in curves:
+        rotation[:, 0] = 1.0
+
+    displacement = location[-1] - location[0]
+    distance = float(np.linalg.norm(np.diff(location, axis=0), axis=1).sum())
+    duration = (end - start) / fps
+    yaw = np.unwrap(mixamokernels.quaternion_yaw(rotation))
+
+    # a clip loops if every bone ends in the pose it started with
+    loops = True
+    for (data_path, index), co in curves.items():
+        if not data_path.startswith('pose.bones') or len(co) < 2:
+            continue
+        first, last = co[0, 1], co[-1, 1]
+        if data_path.endswith('rotation_quaternion'):
+            # q and -q are the same rotation
+            components = (curves.get((data_path, i)) for i in range(4))
+            if sum(c[0, 1] * c[-1, 1] for c in components if c is not None and len(c)) < 0.0:
+                last = -last
+        if abs(first - last) > loop_tolerance:
+            loops = False
+            break
+
+    return {
+        'frame_start': start,
+        'frame_end': end,
+        'fps': fps,
+        'displacement': displacement.tolist(),
+        'distance': distance,
+        'average_speed': distance / duration if duration > 0.0 else 0.0,
+        'turn_angle': float(np.degrees(yaw[-1] - yaw[0])),
+        'loops': loops,
+    }
+
+def write_clip_index(dest_dir, entries, name='clip_index'):
+    """writes metadata of converted clips to dest_dir as name.json and as columnar name.npz"""
+    dest_dir = Path(dest_dir)
+    with open(dest_dir.joinpath(name + '.json'), 'w') as index_file:
+        json.dump(entries, index_file, indent=1)
+    np.savez(dest_dir.joinpath(name + '.npz'),
+             clip=np.array([entry['clip'] for entry in entries], dtype=str),
+             frame_start=np.array([entry['frame_start'] for entry in entries], dtype=np.int32),
+             frame_end=np.array([entry['frame_end'] for entry in entries], dtype=np.int32),
+             fps=np.array([entry['fps'] for entry in entries], dtype=np.float32),
+             displacement=np.array([entry['displacement'] for entry in entries], dtype=np.float32).reshape(-1, 3),
+             distance=np.array([entry['distance'] for entry in entries], dtype=np.float32),
+             average_speed=np.array([entry['average_speed'] for entry in entries], dtype=np.float32),
+             turn_angle=np.array([entry['turn_angle'] for entry in entries], dtype=np.float32),
+             loops=np.array([entry['loops'] for entry in entries], dtype=bool))
+
+FINGERPRINT_BONES = ('Hips', 'Spine', 'Head', 'LeftHand', 'RightHand', 'LeftFoot', 'RightFoot')
+
+def motion_fingerprint(armature, samples=32, step=0.02):
+    """quantized signature of the motion of the hips and key bones of an imported clip
+
+    The action is resampled to samples frames over its own frame range, so clips at different frame offsets match,
+    and hips locations are measured in units of the rest height of the hips, so clips at different scales match.
+    Returns None if the armature has no animation or none of the FINGERPRINT_BONES.
+    """
+    if armature.animation_data is None or armature.animation_data.action is None:
+        return None
+    action = armature.animation_data.action
+    curves = read_action_curves(action)
+    start, end = action.frame_range
+    frames = np.linspace(start, end, samples)
+    bones = {remove_namespace(bone.name): bone for bone in armature.pose.bones}
+
+    channels = []
+    hips = bones.get('Hips')
+    if hips is not None:
+        unit = armature.data.bones[hips.name].head_local.length or 1.0
+        channels.append(sample_curves(curves, hips.path_from_id('location'), 3, frames) / unit)
+    for name in FINGERPRINT_BONES:
+        bone = bones.get(name)
+        if bone is None:
+            continue
+        data_path = bone.path_from_id('rotation_quaternion')
+        rotation = sample_curves(curves, data_path, 4, frames)
+        if (data_path, 0) not in curves:
+            rotation[:, 0] = 1.0
+        # q and -q are the same rotation, start in the hemisphere of positive w
+        rotation = mixamokernels.make_continuous(rotation)
+        if rotation[0, 0] < 0.0:
+            rotation = -rotation
+        channels.append(rotation)
+    if not channels:
+        return None
+    return {
+        'frames': int(round(end - start)),
+        'signature': np.round(np.concatenate(channels, axis=1) / step).astype(np.int32),
+    }
+
+class DuplicateFinder:
+    '''groups clips by motion_fingerprint
+
+    A clip joins the first group whose representative has the same length (give or take a frame) and whose
+    signature differs by at most tolerance quantization steps in every value.
+    '''
+    def __init__(self, tolerance=1):
+        self.tolerance = tolerance
+        self.groups = []
+    def find(self, fingerprint):
+        """returns the group a clip with fingerprint belongs to or None"""
+        for group in self.groups:
+            other = group['fingerprint']
+            if (abs(other['frames'] - fingerprint['frames']) <= 1
+                    and other['signature'].shape == fingerprint['signature'].shape
+                    and np.abs(other['signature'] - fingerprint['signature']).max() <= self.tolerance):
+                return group
+        return None
+    def add(self, source, fingerprint):
+        """starts a new group with source as representative"""
+        group = {'source': source, 'fingerprint': fingerprint, 'duplicates': [], 'outputs': [], 'entries': []}
+        self.groups.append(group)
+        return group
+    def report(self):
+        return [{'clip': str(group['source'].rel), 'duplicates': [str(source.rel) for source in group['duplicates']]}
+                for group in self.groups if group['duplicates']]
+
+def link_or_copy(source, target, mode='link'):
+    """hard links source to target, copies it if mode is 'copy' or linking is not possible"""
+    if target.exists():
+        target.unlink()
+    if mode == 'link':
+        try:
+            os.link(source, target)
+            return
+        except OSError:
+            pass
+    shutil.copy2(source, target)
+
+
+def clear_scene():
+    """deletes all objects and removes all meshes, materials and actions"""
+    bpy.ops.object.select_all(action='SELECT')
+    bpy.ops.object.delete(use_global=True)
+
+    # remove all datablocks
+    for mesh in bpy.data.meshes:
+        bpy.data.meshes.remove(mesh, do_unlink=True)
+    for material in bpy.data.materials:
+        bpy.data.materials.remove(material, do_unlink=True)
+    for action in bpy.data.actions:
+        bpy.data.actions.remove(action, do_unlink=True)
+
+def import_fbx(filepath, ignore_leaf_bones=True, automatic_bone_orientation=True, use_image_search=True):
+    """imports an FBX with the settings used for mixamo rigs, the imported objects are selected afterwards"""
+    bpy.ops.import_scene.fbx(
+        filepath=str(filepath), axis_forward='-Z',
+        axis_up='Y', directory="",
+        filter_glob="*.fbx", ui_tab='MAIN',
+        use_manual_orientation=False, global_scale=1.0,
+        bake_space_transform=False,
+        use_custom_normals=True,
+        use_image_search=use_image_search,
+        use_alpha_decals=False, decal_offset=0.0,
+        use_anim=True, anim_offset=1.0,
+        use_custom_props=True,
+        use_custom_props_enum_as_string=True,
+        ignore_leaf_bones=ignore_leaf_bones,
+        force_connect_children=False,
+        automatic_bone_orientation=automatic_bone_orientation,
+        primary_bone_axis='Y',
+        secondary_bone_axis='X',
+        use_prepost_rot=True)
+
+def get_armature(objects):
+    """returns the first armature in objects"""
+    for a in objects:
+        if a.type == 'ARMATURE':
+            return a
+    raise TypeError("No Armature found")
+
+def sample_world_pose(armature, frames):
+    """returns the world space matrices of all pose bones of armature at frames as array of shape (frames, bones, 4, 4)"""
+    scene = bpy.context.scene
+    bone_count = len(armature.pose.bones)
+    matrices = np.empty((len(frames), bone_count, 4, 4))
+    flat = np.empty(bone_count * 16, dtype=np.float32)
+    for i, frame in enumerate(frames):
+        scene.frame_set(int(frame))
+        armature.pose.bones.foreach_get('matrix', flat)
+        # matrices come column major from foreach_get
+        matrices[i] = np.array(armature.matrix_world) @ flat.reshape(-1, 4, 4).transpose(0, 2, 1)
+    return matrices
+
+SOURCE_SUFFIXES = ('.fbx', '.dae')
+ARCHIVE_SUFFIXES = ('.zip',)
+
+# members of archives are extracted to memory backed tmpfs where there is one
+EXTRACT_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+class SourceFile:
+    '''file to convert, rel is its path relative to the source directory which the output tree mirrors
+
+    If member is given, path is a zip archive and the file to convert is the member of that name inside it.
+    '''
+    def __init__(self, path, rel, member=None):
+        self.path = Path(path)
+        self.rel = PurePosixPath(rel)
+        self.member = member
+    def sidecar(self, suffix='.json'):
+        """contents of the json file of the same name next to the file (or next to the member in its archive), None if there is none"""
+        if self.member is None:
+            path = self.path.with_suffix(suffix)
+            if not path.is_file():
+                return None
+            with open(path) as sidecar_file:
+                return json.load(sidecar_file)
+        name = str(PurePosixPath(self.member).with_suffix(suffix))
+        with zipfile.ZipFile(self.path) as archive:
+            if name not in archive.namelist():
+                return None
+            return json.loads(archive.read(name))
+    @contextmanager
+    def local_file(self):
+        """path the importers can read the file from, members of archives only exist until the with block is left"""
+        if self.member is None:
+            yield self.path
+            return
+        with tempfile.TemporaryDirectory(prefix='mixamoconv_', dir=EXTRACT_DIR) as directory:
+            filepath = Path(directory).joinpath(PurePosixPath(self.member).name)
+            with zipfile.ZipFile(self.path) as archive, archive.open(self.member) as member, open(filepath, 'wb') as target:
+                shutil.copyfileobj(member, target)
+            yield filepath
+    def output_path(self, dest_dir, suffix='.fbx'):
+        """path of the converted file in dest_dir, creating the mirrored subdirectories
+
+        Raises ValueError instead if the path would end up outside of dest_dir.
+        """
+        directory = Path(dest_dir).joinpath(*self.rel.parent.parts)
+        path = directory.joinpath(self.rel.stem + suffix)
+        root = os.path.realpath(dest_dir)
+        if os.path.commonpath((root, os.path.realpath(path))) != root:
+            raise ValueError("%s would be written outside of %s" % (path, dest_dir))
+        directory.mkdir(parents=True, exist_ok=True)
+        return path
+
+def matches(rel, patterns):
+    """whether the relative path rel or its file name matches one of the glob patterns"""
+    return any(fnmatch(rel, pattern) or fnmatch(rel.rsplit('/', 1)[-1], pattern) for pattern in patterns)
+
+def member_path(name):
+    """relative path of the zip member name, None if it is absolute or leaves the archive with .."""
+    path = PurePosixPath(name.replace('\\', '/'))
+    if path.is_absolute() or '..' in path.parts or (path.parts and ':' in path.parts[0]):
+        return None
+    return path
+
+def scan_archive(archive_path, rel, include=('*',), exclude=()):
+    """lists convertible members of the zip archive archive_path like scan_library, rel is the path of the archive without suffix"""
+    include = include or ('*',)
+    listing = []
+    mtime_ns = os.stat(archive_path).st_mtime_ns
+    with zipfile.ZipFile(archive_path) as archive:
+        for info in archive.infolist():
+            path = member_path(info.filename)
+            if path is None:
+                log.warning("WARNING skipping %s in %s, it points outside of the archive", info.filename, archive_path)
+                continue
+            if info.is_dir() or path.suffix.lower() not in SOURCE_SUFFIXES:
+                continue
+            member_rel = rel + '/' + path.as_posix()
+            if matches(member_rel, include) and not matches(member_rel, exclude):
+                listing.append({'path': member_rel, 'size': info.file_size, 'mtime_ns': mtime_ns,
+                                'archive': rel + os.path.splitext(archive_path)[1], 'member': info.filename})
+    return listing
+
+def scan_library(source_dir, recursive=False, include=('*',), exclude=(), archives=False):
+    """lists convertible files of source_dir as [{'path': relative posix path, 'size': ..., 'mtime_ns': ...}] sorted by path
+
+    With archives, the members of zip archives are listed as well, under the path of the archive without suffix.
+    Their entries also have the relative 'archive' path and the 'member' name inside it.
+    An empty include matches every file.
+    """
+    include = include or ('*',)
+    listing = []
+    directories = ['']
+    while directories:
+        directory = directories.pop()
+        with os.scandir(os.path.join(source_dir, directory)) as entries:
+            for entry in entries:
+                rel = directory + '/' + entry.name if directory else entry.name
+                if entry.is_dir():
+                    if recursive and not matches(rel, exclude):
+                        directories.append(rel)
+                elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in SOURCE_SUFFIXES:
+                    if matches(rel, include) and not matches(rel, exclude):
+                        stat = entry.stat()
+                        listing.append({'path': rel, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+                elif archives and entry.is_file() and os.path.splitext(entry.name)[1].lower() in ARCHIVE_SUFFIXES:
+                    if not matches(rel, exclude):
+                        listing.extend(scan_archive(entry.path, os.path.splitext(rel)[0], include, exclude))
+    listing.sort(key=lambda item: item['path'])
+    return listing
+
+def load_manifest(dest_dir, source_dir, recursive, include, exclude, rescan=True, name='manifest.json', archives=False):
+    """returns the listing of source_dir, taken from the run manifest in dest_dir unless rescan is set or the scan options changed"""
+    manifest_path = Path(dest_dir).joinpath(name)
+    scan_options = {'source_dir': str(source_dir), 'recursive': recursive, 'include': list(include), 'exclude': list(exclude),
+                    'archives': archives}
+    if not rescan and manifest_path.is_file():
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        if all(manifest.get(key) == value for key, value in scan_options.items()):
+            return manifest['files']
+    listing = scan_library(source_dir, recursive, include, exclude, archives)
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(manifest_path, 'w') as manifest_file:
+        json.dump(dict(scan_options, files=listing), manifest_file, indent=1)
+    return listing
+
+
 def batch_hip_to_root(source_dir, dest_dir, use_x=True, use_y=True, use_z=True, on_ground=True, use_rotation=True, scale=1.0,
                       restoffset=(0, 0, 0), hipname='', fixbind=True, apply_rotation=True, apply_scale=False,
-                      b_remove_namespace=True, b_unreal_bones=False, add_leaf_bones=False, knee_offset=(0, 0, 0), ignore_leaf_bones=True, automatic_bone_orientation=True, quaternion_clean_pre=True, quaternion_clean_post=True, foot_bone_workaround=False):
-    """Batch Convert MixamoRigs"""
-    
+                      b_remove_namespace=True, b_unreal_bones=False, add_leaf_bones=False, knee_offset=(0, 0, 0), ignore_leaf_bones=True, automatic_bone_orientation=True, quaternion_clean_pre=True, quaternion_clean_post=True, foot_bone_workaround=False,
+                      export_profiles=None, write_index=False, files=None,
+                      recursive=False, include=('*',), exclude=(), rescan=True, target_fps=0, anim_only=False,
+                      stream_collada=False, chunk_size=0, telemetry_dir=None, prometheus_path=None,
+                      deduplicate=None, duplicate_tolerance=1, mirror=False, archives=False, frame_range=None, split_clips=False):
+    """Batch Convert MixamoRigs
+
+    If export_profiles (a list of ExportProfile) is given, every file is imported and converted once
+    and then exported once per profile instead of once to dest_dir with the b_* naming options.
+    If files is given, only those files are converted instead of all files in source_dir.
+    Otherwise source_dir (and with recursive its subdirectories) is listed once up front, filtered by the
+    include/exclude glob patterns, and the listing is stored in manifest.json in dest_dir, from where it is
+    reused if rescan is disabled. The output tree mirrors the directories of source_dir.
+    With archives, the fbx and dae files inside zip archives in source_dir are converted as well, as if the archive
+    was a folder of the same name. Zip archives given in files are always read. Each member is only extracted
+    (to /dev/shm where available) while it is imported.
+    With anim_only, meshes, materials and images of the imported files are deleted before conversion and
+    only the armature with its animation (and the binddummy from fixbind) is exported.
+    With stream_collada, .dae files are read by the streaming reader in mixamocollada instead of the Collada importer.
+    If write_index is set, metadata of all converted clips (see clip_metadata) is written to dest_dir
+    as clip_index.json and clip_index.npz.
+    If telemetry_dir is given, an event per file with the time spent in every Status stage is appended to
+    telemetry.jsonl there and a summary of the run (clips per minute, failure rate, percentile timings per
+    stage, peak memory) is written to telemetry_summary.json. prometheus_path is a .prom file for the
+    textfile collector of the prometheus node exporter the summary is also written to.
+    If deduplicate is 'link' or 'copy', every clip is fingerprinted after import (see motion_fingerprint and
+    DuplicateFinder) and only the first clip of a group of near identical motions is converted, the outputs of the
+    others are hard links to (or copies of) its files. The groups are written to duplicates.json in dest_dir.
+    With mirror, a left/right mirrored version of every clip (see mirror_action) is exported next to it
+    as <name>_mirror.fbx.
+    With frame_range (start, end), only these frames of every file are converted. With split_clips, every file
+    is split into named clips exported as <name>_<clip>.fbx. The clips are read from a json file next to it with
+    the same name, like {"walk": [1, 30], "turn": [31, 58]}, or else run from one marker of its action to the next.
+    Only the frames of the clips are converted.
+    """
+
     source_dir = Path(source_dir)
     dest_dir = Path(dest_dir)
+    include = include or ('*',)
 
     bpy.context.scene.unit_settings.system = 'METRIC'
     bpy.context.scene.unit_settings.scale_length = 1
 
     numfiles = 0
-    for file in source_dir.iterdir():
-        if not file.is_file():
+    index_entries = []
+    duplicates = DuplicateFinder(duplicate_tolerance)
+    if telemetry_dir is not None:
+        telemetry_dir = Path(telemetry_dir)
+        telemetry_dir.mkdir(parents=True, exist_ok=True)
+        telemetry = mixamotelemetry.Telemetry(telemetry_dir.joinpath('telemetry.jsonl'),
+                                              telemetry_dir.joinpath('telemetry_summary.json'), prometheus_path)
+    else:
+        telemetry = mixamotelemetry.Telemetry(prometheus_path=prometheus_path)
+    if files is None:
+        listing = load_manifest(dest_dir, source_dir, recursive, include, exclude, rescan, archives=archives)
+        sources = [SourceFile(source_dir.joinpath(item.get('archive', item['path'])), item['path'], item.get('member'))
+                   for item in listing]
+    else:
+        sources = []
+        for file in map(Path, files):
+            try:
+                rel = file.relative_to(source_dir).as_posix()
+            except ValueError:
+                rel = file.name
+            if file.suffix.lower() in ARCHIVE_SUFFIXES:
+                sources.extend(SourceFile(file, item['path'], item['member'])
+                               for item in scan_archive(file, os.path.splitext(rel)[0], include, exclude))
+            else:
+                sources.append(SourceFile(file, rel))
+    for source in sources:
+        if not source.path.is_file():
             continue
-        file_ext = file.suffix
+        file_ext = source.rel.suffix.lower()
         file_loader = {
-            ".fbx": lambda filename: bpy.ops.import_scene.fbx(
-                filepath=str(filename), axis_forward='-Z',
-                axis_up='Y', directory="",
-                filter_glob="*.fbx", ui_tab='MAIN',
-                use_manual_orientation=False, global_scale=1.0,
-                bake_space_transform=False,
-                use_custom_normals=True,
-                use_image_search=True,
-                use_alpha_decals=False, decal_offset=0.0,
-                use_anim=True, anim_offset=1.0,
-                use_custom_props=True,
-                use_custom_props_enum_as_string=True,
-                ignore_leaf_bones=ignore_leaf_bones,
-                force_connect_children=False,
-                automatic_bone_orientation=automatic_bone_orientation,
-                primary_bone_axis='Y',
-                secondary_bone_axis='X',
-                use_prepost_rot=True),
-            ".dae": lambda filename: bpy.ops.wm.collada_import(
+            ".fbx": lambda filename: import_fbx(filename, ignore_leaf_bones, automatic_bone_orientation,
+                                                use_image_search=not anim_only),
+            ".dae": lambda filename: mixamocollada.import_collada(filename) if stream_collada else bpy.ops.wm.collada_import(
                 filepath=str(filename), filter_blender=False,
                 filter_backup=False, filter_image=False,
                 filter_movie=False, filter_python=False,
@@ -475,69 +1355,142 @@ def batch_hip_to_root(source_dir, dest_dir, use_x=True, use_y=True, use_z=True,
         if not file_ext in file_loader:
             continue
         numfiles += 1
-        bpy.ops.object.select_all(action='SELECT')
-        bpy.ops.object.delete(use_global=True)
-
-        # remove all datablocks
-        for mesh in bpy.data.meshes:
-            bpy.data.meshes.remove(mesh, do_unlink=True)
-        for material in bpy.data.materials:
-            bpy.data.materials.remove(material, do_unlink=True)
-        for action in bpy.data.actions:
-            bpy.data.actions.remove(action, do_unlink=True)
-
-        # import FBX
-        file_loader[file_ext](file)
-
-        # namespace removal
-        if b_remove_namespace:
-            for obj in bpy.context.selected_objects:
-                remove_namespace(obj)
-        # namespace removal
-        elif b_unreal_bones:
-            for obj in bpy.context.selected_objects:
-                rename_bones(obj, 'unreal')
-
-        def getArmature(objects):
-            for a in objects:
-                if a.type == 'ARMATURE':
-                    return a
-            raise TypeError("No Armature found")
-
-        armature = getArmature(bpy.context.selected_objects)
-
-        # do hip to Root conversion
+        telemetry.start_file(source.rel)
         try:
+            clear_scene()
+
+            # import FBX
+            with source.local_file() as filepath:
+                file_loader[file_ext](filepath)
+            telemetry.stage('import')
+            armature = get_armature(bpy.context.selected_objects)
+
+            # link or copy the outputs of an already converted clip with the same motion
+            group = None
+            if deduplicate is not None:
+                fingerprint = motion_fingerprint(armature)
+                telemetry.stage('fingerprint')
+                if fingerprint is not None:
+                    group = duplicates.find(fingerprint)
+                    if group is not None:
+                        log.info("%s is a duplicate of %s" % (source.rel, group['source'].rel))
+                        group['duplicates'].append(source)
+                        for output_dir, suffix in group['outputs']:
+                            link_or_copy(group['source'].output_path(output_dir, suffix), source.output_path(output_dir, suffix), deduplicate)
+                        clip = str(group['source'].rel.with_suffix(''))
+                        for entry in group['entries']:
+                            index_entries.append(dict(entry, clip=str(source.rel.with_suffix('')) + entry['clip'][len(clip):]))
+                        bpy.ops.object.select_all(action='SELECT')
+                        bpy.ops.object.delete(use_global=False)
+                        telemetry.finish_file()
+                        continue
+                    group = duplicates.add(source, fingerprint)
+
+            # namespace removal, export profiles rename the bones on export instead
+            if export_profiles is None and b_remove_namespace:
+                for obj in bpy.context.selected_objects:
+                    remove_namespace(obj)
+            # namespace removal
+            elif export_profiles is None and b_unreal_bones:
+                for obj in bpy.context.selected_objects:
+                    rename_bones(obj, 'unreal')
+
+            if anim_only:
+                strip_to_armature(armature)
+
+            # named frame ranges from a json file next to the source or from the markers of its action
+            clips = None
+            if split_clips:
+                clips = source.sidecar()
+                if clips is not None:
+                    clips = {name: (int(start), int(end)) for name, (start, end) in clips.items()}
+                else:
+                    clips = marker_clips(armature)
+                if clips:
+                    check_clip_names(clips)
+
+            # bones still carry their namespace when exporting to profiles
+            foot_bones = None
+            if export_profiles is not None:
+                foot_bones = [bone.name for bone in armature.data.bones if remove_namespace(bone.name) in ('RightToeBase', 'LeftToeBase')]
+            elif b_unreal_bones:
+                foot_bones = ["ball_r", "ball_l"]
+
+            # do hip to Root conversion
             for step in hip_to_root(armature, use_x=use_x, use_y=use_y, use_z=use_z, on_ground=on_ground, use_rotation=use_rotation, scale=scale,
                         restoffset=restoffset, hipname=hipname, fixbind=fixbind, apply_rotation=apply_rotation,
-                        apply_scale=apply_scale, quaternion_clean_pre=quaternion_clean_pre, quaternion_clean_post=quaternion_clean_post, foot_bone_workaround=foot_bone_workaround):
+                        apply_scale=apply_scale, quaternion_clean_pre=quaternion_clean_pre, quaternion_clean_post=quaternion_clean_post, foot_bone_workaround=foot_bone_workaround,
+                        target_fps=target_fps, chunk_size=chunk_size, frame_range=frame_range, clips=clips, foot_bones=foot_bones):
                 #DEBUG log.error(str(step))
-                pass
+                telemetry.stage(step.stage)
+
+            if (Vector(knee_offset).length > 0.0):
+                knee_bones = bpy.context.scene.mixamo.knee_bones.split(',')
+                if export_profiles is not None:
+                    # bones still carry their namespace when exporting to profiles
+                    knee_bones = [bone.name for bone in armature.data.bones if remove_namespace(bone.name) in knee_bones]
+                elif b_unreal_bones:
+                    knee_bones = ["calf_r", "calf_l"]
+                apply_kneefix(armature, knee_offset, bonenames=knee_bones)
+
+            telemetry.stage('postprocess')
+
+            # the exporter writes every action of the armature, so the takes are exported one at a time
+            base_name = armature.animation_data.action.name
+            takes = [('', None)]
+            if clips:
+                clip_actions = get_clip_actions()
+                takes = [('_' + name, (read_action_curves(clip_actions[name]), read_action_interpolation(clip_actions[name])))
+                         for name in clips]
+
+            # remove newly created orphan actions
+            for action in bpy.data.actions:
+                if action != armature.animation_data.action:
+                    bpy.data.actions.remove(action, do_unlink=True)
+
+            # store file to disk
+            outputs = []
+            entries = []
+            clip = str(source.rel.with_suffix(''))
+            for take, clip_curves in takes:
+                if clip_curves is not None:
+                    action = armature.animation_data.action
+                    curves, interpolation = clip_curves
+                    write_action_curves(armature, curves, name=base_name + take, interpolation=interpolation)
+                    bpy.data.actions.remove(action, do_unlink=True)
+                if write_index:
+                    entries.append(dict(clip_metadata(armature), clip=clip + take))
+                outputs += export_outputs(source, dest_dir, export_profiles, take + '.fbx', add_leaf_bones, anim_only)
+                telemetry.stage('export')
+
+                # the converted take makes way for its mirror
+                if mirror:
+                    action = armature.animation_data.action
+                    armature.animation_data.action = mirror_action(armature)
+                    bpy.data.actions.remove(action, do_unlink=True)
+                    telemetry.stage('mirror')
+                    if write_index:
+                        entries.append(dict(clip_metadata(armature), clip=clip + take + '_mirror'))
+                    outputs += export_outputs(source, dest_dir, export_profiles, take + '_mirror.fbx', add_leaf_bones, anim_only)
+                    telemetry.stage('export mirror')
+            index_entries.extend(entries)
+            if group is not None:
+                group['outputs'] = outputs
+                group['entries'] = entries
+            bpy.ops.object.select_all(action='SELECT')
+            bpy.ops.object.delete(use_global=False)
         except Exception as e:
-            log.error("ERROR hip_to_root raised %s when processing %s" % (str(e), file.name))
+            log.error("ERROR %s raised %s when processing %s" % (type(e).__name__, str(e), source.rel))
+            telemetry.finish_file(False, str(e))
+            telemetry.finish_run()
             return -1
-
-
-        if (Vector(knee_offset).length > 0.0):
-            apply_kneefix(armature, knee_offset,
-                          bonenames=bpy.context.scene.mixamo.knee_bones.split(','))
-
-        # remove newly created orphan actions
-        for action in bpy.data.actions:
-            if action != armature.animation_data.action:
-                bpy.data.actions.remove(action, do_unlink=True)
-
-        # store file to disk
-        output_file = dest_dir.joinpath(file.stem + ".fbx")
-        bpy.ops.export_scene.fbx(filepath=str(output_file),
-                                 use_selection=False,
-                                 apply_unit_scale=False,
-                                 add_leaf_bones=add_leaf_bones,
-                                 axis_forward='-Z',
-                                 axis_up='Y',
-                                 mesh_smooth_type='FACE')
-        bpy.ops.object.select_all(action='SELECT')
-        bpy.ops.object.delete(use_global=False)
+        telemetry.finish_file()
+    if write_index:
+        write_clip_index(dest_dir, index_entries)
+    if deduplicate is not None:
+        with open(dest_dir.joinpath('duplicates.json'), 'w') as report_file:
+            json.dump(duplicates.report(), report_file, indent=1)
+    telemetry.finish_run()
     return numfiles
 
 
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Copyright (C) 2017-2021  Enzio Probst
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+# Compares converted clips numerically: per bone maximum and RMS difference of world space position and rotation over all frames.
+#
+#   blender -b --python mixamodiff.py -- <clip or folder A> <clip or folder B> [--position-tolerance 0.001]
+#                                        [--rotation-tolerance 0.1] [--report report.json]
+#
+# Folders are compared clip by clip (matched by their relative path). The exit code is 1 if any clip exceeds a tolerance.
+# compare_poses only needs numpy and can be used on sampled poses outside of blender.
+
+from pathlib import Path
+import sys
+import json
+import argparse
+import logging
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import mixamoheadless
+
+log = logging.getLogger(__name__)
+
+
+def compare_poses(matrices_a, matrices_b):
+    """per bone max and rms difference of world matrices of shape (frames, bones, 4, 4), positions in scene units, rotations in degrees"""
+    position_error = np.linalg.norm(matrices_a[..., :3, 3] - matrices_b[..., :3, 3], axis=-1)
+    rotation_a = matrices_a[..., :3, :3] / np.linalg.norm(matrices_a[..., :3, :3], axis=-2, keepdims=True)
+    rotation_b = matrices_b[..., :3, :3] / np.linalg.norm(matrices_b[..., :3, :3], axis=-2, keepdims=True)
+    # angle of the relative rotation from the trace of rotation_a^T @ rotation_b
+    trace = np.einsum('...ji,...ji->...', rotation_a, rotation_b)
+    rotation_error = np.degrees(np.arccos(np.clip((trace - 1.0) / 2.0, -1.0, 1.0)))
+    return {
+        'max_position': position_error.max(axis=0),
+        'rms_position': np.sqrt(np.mean(position_error ** 2, axis=0)),
+        'max_rotation': rotation_error.max(axis=0),
+        'rms_rotation': np.sqrt(np.mean(rotation_error ** 2, axis=0)),
+    }
+
+
+def load_clip(mixamoconv, filepath):
+    """imports a converted clip and samples it, returns bone names and world matrices of shape (frames, bones, 4, 4)"""
+    import bpy
+    mixamoconv.clear_scene()
+    mixamoconv.import_fbx(filepath)
+    armature = mixamoconv.get_armature(bpy.context.selected_objects)
+    start, end = (int(round(f)) for f in armature.animation_data.action.frame_range)
+    names = [bone.name for bone in armature.pose.bones]
+    return names, mixamoconv.sample_world_pose(armature, range(start, end + 1))
+
+
+def compare_clips(mixamoconv, file_a, file_b, position_tolerance=0.001, rotation_tolerance=0.1):
+    """compares two converted clips, returns a report entry for them"""
+    names_a, matrices_a = load_clip(mixamoconv, file_a)
+    names_b, matrices_b = load_clip(mixamoconv, file_b)
+    common = [name for name in names_a if name in names_b]
+    frames = min(len(matrices_a), len(matrices_b))
+    report = {
+        'a': str(file_a),
+        'b': str(file_b),
+        'frames': [len(matrices_a), len(matrices_b)],
+        'missing_bones': sorted(set(names_a).symmetric_difference(names_b)),
+    }
+    if not common or frames == 0:
+        report['exceeds'] = True
+        return report
+    index_a = [names_a.index(name) for name in common]
+    index_b = [names_b.index(name) for name in common]
+    errors = compare_poses(matrices_a[:frames, index_a], matrices_b[:frames, index_b])
+    report['max_position'] = float(errors['max_position'].max())
+    report['rms_position'] = float(np.sqrt(np.mean(errors['rms_position'] ** 2)))
+    report['max_rotation'] = float(errors['max_rotation'].max())
+    report['rms_rotation'] = float(np.sqrt(np.mean(errors['rms_rotation'] ** 2)))
+    report['bones'] = {name: {key: float(values[i]) for key, values in errors.items()} for i, name in enumerate(common)}
+    report['exceeds'] = bool(report['max_position'] > position_tolerance or report['max_rotation'] > rotation_tolerance
+                             or report['missing_bones'] or report['frames'][0] != report['frames'][1])
+    return report
+
+
+def compare(path_a, path_b, position_tolerance=0.001, rotation_tolerance=0.1):
+    """compares two converted clips or two folders of converted clips, returns a list of report entries"""
+    mixamoconv = mixamoheadless.load_addon()
+    path_a = Path(path_a)
+    path_b = Path(path_b)
+    if path_a.is_file():
+        pairs = [(path_a, path_b)]
+    else:
+        listing = mixamoconv.scan_library(path_a, recursive=True, include=('*.fbx',))
+        pairs = [(path_a.joinpath(item['path']), path_b.joinpath(item['path'])) for item in listing]
+    reports = []
+    for file_a, file_b in pairs:
+        if not file_b.is_file():
+            reports.append({'a': str(file_a), 'b': str(file_b), 'missing': True, 'exceeds': True})
+            continue
+        reports.append(compare_clips(mixamoconv, file_a, file_b, position_tolerance, rotation_tolerance))
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="mixamodiff", description="Compares converted mixamo clips numerically")
+    parser.add_argument("a", help="converted clip or folder")
+    parser.add_argument("b", help="converted clip or folder to compare with")
+    parser.add_argument("--position-tolerance", type=float, default=0.001, help="maximum position difference in scene units")
+    parser.add_argument("--rotation-tolerance", type=float, default=0.1, help="maximum rotation difference in degrees")
+    parser.add_argument("--report", help="json file to write the full report to")
+    args = parser.parse_args(mixamoheadless.script_args())
+
+    logging.basicConfig(level=logging.INFO)
+    reports = compare(args.a, args.b, args.position_tolerance, args.rotation_tolerance)
+    if args.report is not None:
+        with open(args.report, 'w') as report_file:
+            json.dump(reports, report_file, indent=1)
+    failed = [report for report in reports if report['exceeds']]
+    for report in failed:
+        log.error("%s differs: position %s, rotation %s, frames %s, missing bones %s", report['a'],
+                  report.get('max_position'), report.get('max_rotation'), report.get('frames'), report.get('missing_bones'))
+    log.info("%d of %d clips within tolerance", len(reports) - len(failed), len(reports))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
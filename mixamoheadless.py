@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Copyright (C) 2017-2021  Enzio Probst
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+# helpers for running the converter in a background blender (blender -b --python <script> -- <args>)
+
+from pathlib import Path
+import sys
+import json
+import importlib
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def load_addon():
+    """imports and registers the add-on this file belongs to, returns its mixamoconv module"""
+    import bpy
+    package_dir = Path(__file__).resolve().parent
+    if str(package_dir.parent) not in sys.path:
+        sys.path.insert(0, str(package_dir.parent))
+    addon = importlib.import_module(package_dir.name)
+    if not hasattr(bpy.types.Scene, 'mixamo'):
+        addon.register()
+    return addon.mixamoconv
+
+
+def script_args():
+    """returns the command line arguments given to the script after '--'"""
+    if '--' in sys.argv:
+        return sys.argv[sys.argv.index('--') + 1:]
+    return []
+
+
+def batch_options(options, mixamoconv):
+    """turns a dict of batch_hip_to_root keyword arguments read from json into the arguments it expects"""
+    options = dict(options)
+    for name in ('restoffset', 'knee_offset'):
+        if name in options:
+            options[name] = tuple(options[name])
+    if options.get('export_profiles') is not None:
+        options['export_profiles'] = [mixamoconv.ExportProfile(**profile) for profile in options['export_profiles']]
+    return options
+
+
+def load_options(path, mixamoconv):
+    """reads batch_hip_to_root keyword arguments from a json file, returns an empty dict if path is None"""
+    if path is None:
+        return {}
+    with open(path) as options_file:
+        return batch_options(json.load(options_file), mixamoconv)
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Copyright (C) 2017-2021  Enzio Probst
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+# Curve math of the converter on plain numpy arrays, does not need blender.
+#
+# Quaternions are (w, x, y, z) in the last axis, like blender stores them. mixamoconv moves the keyframes of the
+# fcurves in and out with foreach_get/foreach_set and calls these, so they can be profiled and tested in a normal
+# python with numpy.
+#
+#   python mixamokernels.py
+#
+# runs the checks at the end of this file.
+
+from math import pi, sqrt, acos, cos
+import numpy as np
+
+
+def quaternion_multiply(q0, q1):
+    """hamilton product of quaternion arrays of shape (..., 4)"""
+    w0, x0, y0, z0 = np.moveaxis(q0, -1, 0)
+    w1, x1, y1, z1 = np.moveaxis(q1, -1, 0)
+    return np.stack((
+        w0 * w1 - x0 * x1 - y0 * y1 - z0 * z1,
+        w0 * x1 + x0 * w1 + y0 * z1 - z0 * y1,
+        w0 * y1 - x0 * z1 + y0 * w1 + z0 * x1,
+        w0 * z1 + x0 * y1 - y0 * x1 + z0 * w1), axis=-1)
+
+
+def quaternion_conjugate(q):
+    return q * np.array((1.0, -1.0, -1.0, -1.0))
+
+
+def quaternion_yaw(q):
+    """rotation around the Z axis of quaternions of shape (..., 4), the Z angle of their XYZ euler decomposition"""
+    w, x, y, z = np.moveaxis(q, -1, 0)
+    return np.arctan2(2.0 * (w * z + x * y), 1.0 - 2.0 * (y * y + z * z))
+
+
+def make_continuous(quaternions):
+    """flips signs of quaternions of shape (n, 4) so consecutive ones are in the same hemisphere"""
+    dots = np.sum(quaternions[1:] * quaternions[:-1], axis=1)
+    signs = np.concatenate(([1.0], np.cumprod(np.where(dots < 0.0, -1.0, 1.0))))
+    return quaternions * signs[:, None]
+
+
+def _flip_fixed(previous, current):
+    """current (w, x, y, z) turned back by half a turn if it differs from previous by close to one, else None"""
+    pw, px, py, pz = previous
+    cw, cx, cy, cz = current
+    length = sqrt(pw * pw + px * px + py * py + pz * pz) * sqrt(cw * cw + cx * cx + cy * cy + cz * cz)
+    # difference conjugate(previous) * current of the normalized quaternions
+    dw = (pw * cw + px * cx + py * cy + pz * cz) / length
+    if abs(2.0 * acos(min(max(dw, -1.0), 1.0)) - pi) >= 0.5:
+        return None
+    dx = (pw * cx - px * cw - py * cz + pz * cy) / length
+    dy = (pw * cy + px * cz - py * cw - pz * cx) / length
+    dz = (pw * cz - px * cy + py * cx - pz * cw) / length
+    axis_length = sqrt(dx * dx + dy * dy + dz * dz)
+    if axis_length > 1e-12:
+        ax, ay, az = dx / axis_length, dy / axis_length, dz / axis_length
+    else:
+        ax, ay, az = 1.0, 0.0, 0.0
+    # half a turn around the axis times current
+    rw = cos(pi / 2.0)
+    return (rw * cw - ax * cx - ay * cy - az * cz,
+            rw * cx + ax * cw + ay * cz - az * cy,
+            rw * cy - ax * cz + ay * cw + az * cx,
+            rw * cz + ax * cy - ay * cx + az * cw)
+
+
+def quaternion_continuity(quaternions, prevent_flips=True, prevent_inverts=True):
+    """fixes flips and sign swaps from one quaternion of shape (n, 4) to the next, returns the fixed copy
+
+    A flip is a rotation differing by close to half a turn from the previous one, it is turned back around the axis
+    of the difference. A sign swap is a jump of more than 1.0 in the summed components, the quaternion is negated.
+
+    Same result as fixing one quaternion after the other, but only flips are fixed one at a time: whether a
+    quaternion is a flip does not depend on the signs, and the sign of every quaternion follows from the previous
+    one, which is solved for all of them at once.
+    """
+    q = np.array(quaternions, dtype=np.float64)
+    count = len(q)
+    if count < 2:
+        return q
+
+    flipped = np.zeros(count, dtype=bool)
+    if prevent_flips:
+        normalized = q / np.linalg.norm(q, axis=1, keepdims=True)
+        dots = np.clip(np.sum(normalized[:-1] * normalized[1:], axis=1), -1.0, 1.0)
+        candidates = np.nonzero(np.abs(2.0 * np.arccos(dots) - pi) < 0.5)[0] + 1
+        checked = 0
+        for i in candidates.tolist():
+            if i <= checked:
+                continue
+            # fixing one quaternion can make the next one a flip
+            while i < count:
+                fixed = _flip_fixed(q[i - 1].tolist(), q[i].tolist())
+                if fixed is None:
+                    break
+                q[i] = fixed
+                flipped[i] = True
+                i += 1
+            checked = i
+
+    # Each quaternion keeps or changes the sign of the previous one (flips are fixed relative to it and swaps
+    # are judged relative to it), or gets a sign of its own where both of its signs lead to the same result.
+    if prevent_inverts:
+        swap_same = np.abs(q[:-1] - q[1:]).sum(axis=1) > 1.0
+        swap_negated = np.abs(q[:-1] + q[1:]).sum(axis=1) > 1.0
+    else:
+        swap_same = swap_negated = np.zeros(count - 1, dtype=bool)
+    own_sign = np.concatenate(([True], ~flipped[1:] & (swap_same == swap_negated)))
+    sign = np.concatenate(([1.0], np.where(swap_same, -1.0, 1.0)))
+    relative = np.where(own_sign, 1.0, sign)
+    products = np.cumprod(relative)
+    last_own = np.maximum.accumulate(np.where(own_sign, np.arange(count), 0))
+    signs = sign[last_own] * products * products[last_own]
+    return q * signs[:, None]
+
+
+def restoffset_correction(restoffset, scale=1.0):
+    """offset to add to the location keys of a mixamo hip bone when the restpose is moved by restoffset in world space
+
+    The hip bone points up, so world X, Y, Z are its local X, -Z, Y. scale is the scale of the armature object.
+    """
+    return -np.array((restoffset[0], restoffset[2], -restoffset[1]), dtype=np.float64) / scale
+
+
+def slerp(q0, q1, t):
+    """spherical linear interpolation between quaternion arrays q0, q1 of shape (n, 4) by factors t of shape (n,)"""
+    dot = np.sum(q0 * q1, axis=1)
+    q1 = np.where(dot[:, None] < 0.0, -q1, q1)
+    theta = np.arccos(np.clip(np.abs(dot), 0.0, 1.0))
+    sin_theta = np.sin(theta)
+    linear = sin_theta < 1e-6
+    sin_theta = np.where(linear, 1.0, sin_theta)
+    w0 = np.where(linear, 1.0 - t, np.sin((1.0 - t) * theta) / sin_theta)
+    w1 = np.where(linear, t, np.sin(t * theta) / sin_theta)
+    return w0[:, None] * q0 + w1[:, None] * q1
+
+
+def resample_quaternions(quaternions, positions):
+    """samples per frame quaternions of shape (n, 4) at fractional frame positions (0 based) using slerp"""
+    if len(quaternions) == 1:
+        return np.repeat(quaternions, len(positions), axis=0)
+    lower = np.clip(np.floor(positions).astype(int), 0, len(quaternions) - 2)
+    t = np.clip(positions - lower, 0.0, 1.0)
+    return slerp(quaternions[lower], quaternions[lower + 1], t)
+
+
+def resample_frames(start, end, source_fps, target_fps):
+    """frames of the range start to end resampled to target_fps and their fractional positions (0 based) in the source frames"""
+    new_end = start + int(round((end - start) * target_fps / source_fps))
+    new_frames = np.arange(start, new_end + 1, dtype=np.float64)
+    return new_frames, (new_frames - start) * source_fps / target_fps
+
+
+def merge_ranges(ranges):
+    """sorts frame ranges (start, end) and merges overlapping and adjacent ones"""
+    merged = []
+    for start, end in sorted((int(start), int(end)) for start, end in ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def marker_ranges(markers, end):
+    """named frame ranges from markers given as (name, frame), each running up to the next marker or to end"""
+    markers = sorted(markers, key=lambda marker: marker[1])
+    ranges = {}
+    for i, (name, frame) in enumerate(markers):
+        last = markers[i + 1][1] - 1 if i + 1 < len(markers) else int(end)
+        if last < frame:
+            continue
+        if name in ranges:
+            name = '%s_%d' % (name, frame)
+        ranges[name] = (int(frame), int(last))
+    return ranges
+
+
+def trim_keys(co, frame_range, edge_values=None):
+    """keyframe coordinates of shape (n, 2) within frame_range (start, end)
+
+    edge_values, the values of the curve at start and end, are keyed there unless there already is a key,
+    so the curve keeps its values at the edges and is never left without keys.
+    """
+    start, end = frame_range
+    trimmed = co[(co[:, 0] >= start) & (co[:, 0] <= end)]
+    if edge_values is None:
+        return trimmed
+    edges = {frame: value for frame, value in zip((start, end), edge_values) if not np.any(trimmed[:, 0] == frame)}
+    if not edges:
+        return trimmed
+    trimmed = np.concatenate((trimmed, np.array(list(edges.items()), dtype=co.dtype)))
+    return trimmed[np.argsort(trimmed[:, 0], kind='stable')]
+
+
+def resample_range(frame_range, start, source_fps, target_fps):
+    """frame range (start, end) of a clip after resampling frames from start on from source_fps to target_fps"""
+    return tuple(start + int(round((frame - start) * target_fps / source_fps)) for frame in frame_range)
+
+
+def axis_angle_matrix(axis, angle):
+    """4x4 rotation matrix around axis by angle in radians"""
+    x, y, z = axis / np.linalg.norm(axis)
+    c, s = np.cos(angle), np.sin(angle)
+    t = 1.0 - c
+    return np.array([
+        [t * x * x + c, t * x * y - s * z, t * x * z + s * y, 0.0],
+        [t * x * y + s * z, t * y * y + c, t * y * z - s * x, 0.0],
+        [t * x * z - s * y, t * y * z + s * x, t * z * z + c, 0.0],
+        [0.0, 0.0, 0.0, 1.0]])
+
+
+def matrix_to_quaternion(matrices):
+    """converts rotation matrices of shape (n, 3, 3) or larger to quaternions (w, x, y, z) of shape (n, 4)"""
+    m = matrices[:, :3, :3] / np.linalg.norm(matrices[:, :3, :3], axis=1, keepdims=True)
+    w = np.sqrt(np.maximum(0.0, 1.0 + m[:, 0, 0] + m[:, 1, 1] + m[:, 2, 2])) / 2.0
+    x = np.sqrt(np.maximum(0.0, 1.0 + m[:, 0, 0] - m[:, 1, 1] - m[:, 2, 2])) / 2.0
+    y = np.sqrt(np.maximum(0.0, 1.0 - m[:, 0, 0] + m[:, 1, 1] - m[:, 2, 2])) / 2.0
+    z = np.sqrt(np.maximum(0.0, 1.0 - m[:, 0, 0] - m[:, 1, 1] + m[:, 2, 2])) / 2.0
+    x = np.copysign(x, m[:, 2, 1] - m[:, 1, 2])
+    y = np.copysign(y, m[:, 0, 2] - m[:, 2, 0])
+    z = np.copysign(z, m[:, 1, 0] - m[:, 0, 1])
+    quaternions = np.stack((w, x, y, z), axis=1)
+    return quaternions / np.linalg.norm(quaternions, axis=1, keepdims=True)
+
+
+def _reference_continuity(quaternions, prevent_flips=True, prevent_inverts=True):
+    """quaternion_continuity as the keyframe loop of the converter did it with mathutils, one component at a time"""
+    from math import acos, sqrt
+
+    def multiply(a, b):
+        return [a[0] * b[0] - a[1] * b[1] - a[2] * b[2] - a[3] * b[3],
+                a[0] * b[1] + a[1] * b[0] + a[2] * b[3] - a[3] * b[2],
+                a[0] * b[2] - a[1] * b[3] + a[2] * b[0] + a[3] * b[1],
+                a[0] * b[3] + a[1] * b[2] - a[2] * b[1] + a[3] * b[0]]
+
+    result = [list(map(float, q)) for q in quaternions]
+    for i in range(1, len(result)):
+        previous, current = result[i - 1], result[i]
+        if prevent_flips:
+            # Quaternion.rotation_difference: inverse of previous times current
+            length = sum(c * c for c in previous)
+            inverse = [previous[0] / length] + [-c / length for c in previous[1:]]
+            diff = multiply(inverse, current)
+            diff_length = sqrt(sum(c * c for c in diff))
+            angle = 2.0 * acos(max(-1.0, min(1.0, diff[0] / diff_length)))
+            if abs(angle - pi) < 0.5:
+                axis_length = sqrt(sum(c * c for c in diff[1:])) or 1.0
+                # Quaternion.rotate by Quaternion(diff.axis, pi)
+                current = multiply([0.0] + [c / axis_length for c in diff[1:]], current)
+        if prevent_inverts and sum(abs(a - b) for a, b in zip(previous, current)) > 1.0:
+            current = [-c for c in current]
+        result[i] = current
+    return np.array(result)
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+
+    # smooth rotation with sign swaps and half turn flips mixed in
+    angles = np.linspace(0.0, 3.0, 200)
+    axes = np.stack((np.sin(angles), np.cos(angles), np.full(len(angles), 0.5)), axis=1)
+    axes /= np.linalg.norm(axes, axis=1, keepdims=True)
+    quaternions = np.concatenate((np.cos(angles / 2.0)[:, None], axes * np.sin(angles / 2.0)[:, None]), axis=1)
+    for i in rng.choice(len(quaternions), 20, replace=False):
+        quaternions[i] = -quaternions[i]
+    for i in rng.choice(len(quaternions), 10, replace=False):
+        axis = rng.normal(size=3)
+        quaternions[i] = quaternion_multiply(np.concatenate(([0.0], axis / np.linalg.norm(axis))), quaternions[i])
+    for flips in (True, False):
+        for inverts in (True, False):
+            assert np.allclose(quaternion_continuity(quaternions, flips, inverts),
+                               _reference_continuity(quaternions, flips, inverts)), (flips, inverts)
+    # every other frame turned by half a turn, each fixed flip makes the next frame one
+    halfturns = quaternions.copy()
+    halfturns[1::2] = quaternion_multiply(np.array((0.0, 0.0, 0.0, 1.0)), halfturns[1::2])
+    assert np.allclose(quaternion_continuity(halfturns), _reference_continuity(halfturns))
+
+    # slerp ends on its inputs, halves the angle and takes the short way
+    identity = np.array([[1.0, 0.0, 0.0, 0.0]])
+    quarter = np.array([[np.cos(pi / 4.0), 0.0, 0.0, np.sin(pi / 4.0)]])
+    eighth = np.array([[np.cos(pi / 8.0), 0.0, 0.0, np.sin(pi / 8.0)]])
+    assert np.allclose(slerp(identity, quarter, np.array([0.0])), identity)
+    assert np.allclose(slerp(identity, quarter, np.array([1.0])), quarter)
+    assert np.allclose(slerp(identity, quarter, np.array([0.5])), eighth)
+    assert np.allclose(slerp(identity, -quarter, np.array([0.5])), eighth)
+    assert np.allclose(slerp(identity, identity, np.array([0.3])), identity)
+
+    # channels without keys in the range keep their value at its edges
+    held = np.array([[1.0, 0.5]], dtype=np.float32)
+    assert trim_keys(held, (10, 20)).shape == (0, 2)
+    assert np.allclose(trim_keys(held, (10, 20), (0.5, 0.5)), [[10.0, 0.5], [20.0, 0.5]])
+    ends = np.array([[1.0, 0.0], [101.0, 1.0]], dtype=np.float32)
+    assert np.allclose(trim_keys(ends, (11, 21), (0.1, 0.2)), [[11.0, 0.1], [21.0, 0.2]])
+    dense = np.array([[frame, frame * 2.0] for frame in range(1, 31)], dtype=np.float32)
+    assert np.array_equal(trim_keys(dense, (5, 9), (10.0, 18.0)), dense[4:9])
+    assert np.allclose(trim_keys(held, (1, 1), (0.5, 0.5)), held)
+
+    assert merge_ranges([(10, 20), (1, 5), (6, 8), (15, 30), (40, 41)]) == [(1, 8), (10, 30), (40, 41)]
+    assert merge_ranges([]) == []
+
+    assert marker_ranges([('run', 31), ('walk', 1), ('walk', 61)], 90) == {'walk': (1, 30), 'run': (31, 60), 'walk_61': (61, 90)}
+    # a marker on the same frame as the next one has no frames of its own
+    assert marker_ranges([('a', 1), ('b', 1)], 10) == {'b': (1, 10)}
+
+    print("mixamokernels checks passed")
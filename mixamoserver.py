@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Copyright (C) 2017-2021  Enzio Probst
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+# Service mode: a pool of persistent background blenders converting jobs submitted over http on localhost.
+#
+#   python3 mixamoserver.py serve --blender /path/to/blender --workers 4 --port 8765
+#   python3 mixamoserver.py submit <source file> <dest dir> [--options options.json] [--wait]
+#
+# The pool itself runs in a plain python, each worker runs this file inside blender -b.
+#
+#   POST /jobs            {"source": ..., "dest": ..., "options": {...}}  -> {"id": ...}
+#   GET  /jobs            all jobs
+#   GET  /jobs/<id>       status ('queued', 'running', 'done', 'failed'), timings and result of one job
+#
+# Workers take jobs with POST /work and report back with POST /jobs/<id>/result.
+#
+# Only requests addressed to localhost are answered and POST bodies have to be sent as application/json, so web pages
+# opened in a browser on the same machine can't submit jobs.
+
+from pathlib import Path
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import sys
+import ast
+import json
+import time
+import uuid
+import argparse
+import logging
+import threading
+import subprocess
+import urllib.request
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import mixamoheadless
+
+log = logging.getLogger(__name__)
+
+WORK_POLL_TIMEOUT = 30.0
+
+LOCAL_HOSTS = ('127.0.0.1', 'localhost', '[::1]')
+
+
+def batch_option_names():
+    """names of the keyword arguments of mixamoconv.batch_hip_to_root a job can set, read without importing blender"""
+    tree = ast.parse(Path(__file__).resolve().parent.joinpath('mixamoconv.py').read_text())
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name == 'batch_hip_to_root':
+            # source_dir, dest_dir and files come from the job itself
+            return set(arg.arg for arg in node.args.args[2:]) - {'files'}
+    raise RuntimeError("batch_hip_to_root not found in mixamoconv.py")
+
+BATCH_OPTIONS = batch_option_names()
+
+
+class JobQueue:
+    '''thread safe queue of conversion jobs, keeps all jobs for status queries'''
+    def __init__(self):
+        self.jobs = {}
+        self.queued = deque()
+        self.condition = threading.Condition()
+
+    def submit(self, source, dest, options):
+        job = {
+            'id': uuid.uuid4().hex,
+            'source': str(source),
+            'dest': str(dest),
+            'options': options or {},
+            'status': 'queued',
+            'worker': None,
+            'result': None,
+            'error': None,
+            'submitted_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+        }
+        with self.condition:
+            self.jobs[job['id']] = job
+            self.queued.append(job['id'])
+            self.condition.notify()
+        return job
+
+    def take(self, worker, timeout=WORK_POLL_TIMEOUT):
+        """hands the oldest queued job to worker, waits up to timeout seconds for one, returns None if there is none"""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.queued, timeout=timeout):
+                return None
+            job = self.jobs[self.queued.popleft()]
+            job['status'] = 'running'
+            job['worker'] = worker
+            job['started_at'] = time.time()
+            return dict(job)
+
+    def finish(self, job_id, ok, result=None, error=None):
+        with self.condition:
+            job = self.jobs[job_id]
+            if job['status'] != 'running':
+                return
+            job['status'] = 'done' if ok else 'failed'
+            job['result'] = result
+            job['error'] = error
+            job['finished_at'] = time.time()
+            job['queue_seconds'] = job['started_at'] - job['submitted_at']
+            job['run_seconds'] = job['finished_at'] - job['started_at']
+
+    def fail_running(self, worker, error):
+        """fails the jobs of a worker which went away"""
+        with self.condition:
+            running = [job['id'] for job in self.jobs.values() if job['status'] == 'running' and job['worker'] == worker]
+        for job_id in running:
+            self.finish(job_id, False, error=error)
+
+    def get(self, job_id):
+        with self.condition:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def all(self):
+        with self.condition:
+            return [dict(job) for job in self.jobs.values()]
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    '''http api of the pool, self.server.queue is the JobQueue'''
+
+    def send_json(self, code, data=None):
+        body = json.dumps(data).encode() if data is not None else b''
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def is_local(self):
+        """whether the request is addressed to localhost, which a page of another site can't do through dns rebinding"""
+        host = self.headers.get('Host', '')
+        hostname = host.rsplit(':', 1)[0] if not host.endswith(']') else host
+        return hostname in LOCAL_HOSTS
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        if not self.is_local():
+            self.send_json(403, {'error': 'only requests to localhost are accepted'})
+            return
+        parts = self.path.strip('/').split('/')
+        if parts == ['jobs']:
+            self.send_json(200, self.server.queue.all())
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            job = self.server.queue.get(parts[1])
+            self.send_json(200 if job is not None else 404, job)
+        else:
+            self.send_json(404)
+
+    def do_POST(self):
+        if not self.is_local():
+            self.send_json(403, {'error': 'only requests to localhost are accepted'})
+            return
+        # browsers send other content types from any page without asking the server first
+        if self.headers.get('Content-Type', '').split(';')[0].strip() != 'application/json':
+            self.send_json(415, {'error': 'content type has to be application/json'})
+            return
+        parts = self.path.strip('/').split('/')
+        try:
+            data = self.read_json()
+        except ValueError:
+            self.send_json(400, {'error': 'invalid json'})
+            return
+        if parts == ['jobs']:
+            if 'source' not in data or 'dest' not in data:
+                self.send_json(400, {'error': 'source and dest are required'})
+                return
+            options = data.get('options') or {}
+            if not isinstance(options, dict):
+                self.send_json(400, {'error': 'options have to be an object'})
+                return
+            unknown = sorted(set(options) - BATCH_OPTIONS)
+            if unknown:
+                self.send_json(400, {'error': 'unknown options: %s' % ', '.join(unknown)})
+                return
+            job = self.server.queue.submit(data['source'], data['dest'], data.get('options'))
+            self.send_json(202, {'id': job['id']})
+        elif parts == ['work']:
+            job = self.server.queue.take(data.get('worker'))
+            if job is None:
+                self.send_json(204)
+            else:
+                self.send_json(200, job)
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'result':
+            if self.server.queue.get(parts[1]) is None:
+                self.send_json(404)
+                return
+            self.server.queue.finish(parts[1], data.get('ok', False), data.get('result'), data.get('error'))
+            self.send_json(200, {})
+        else:
+            self.send_json(404)
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+
+def post_json(url, data, timeout=None):
+    """posts data as json to url, returns the decoded answer or None for an empty one"""
+    request = urllib.request.Request(url, data=json.dumps(data).encode(),
+                                     headers={'Content-Type': 'application/json'}, method='POST')
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        body = response.read()
+    return json.loads(body) if body else None
+
+
+def get_json(url):
+    with urllib.request.urlopen(url) as response:
+        return json.loads(response.read())
+
+
+def run_worker(url, name):
+    """worker loop running inside blender: takes jobs from the pool at url and converts them until the pool goes away"""
+    mixamoconv = mixamoheadless.load_addon()
+    log.info("worker %s ready", name)
+    while True:
+        try:
+            job = post_json(url + '/work', {'worker': name}, timeout=WORK_POLL_TIMEOUT + 10.0)
+        except OSError:
+            log.info("pool at %s went away, stopping worker %s", url, name)
+            return
+        if job is None:
+            continue
+        source = Path(job['source'])
+        start = time.monotonic()
+        try:
+            options = mixamoheadless.batch_options(job['options'], mixamoconv)
+            Path(job['dest']).mkdir(parents=True, exist_ok=True)
+            numfiles = mixamoconv.batch_hip_to_root(source.parent, job['dest'], files=[source], **options)
+            # a zip archive expands to one file per member
+            ok = numfiles >= 1
+            result = {'numfiles': numfiles, 'convert_seconds': time.monotonic() - start}
+            error = None if ok else 'conversion of %s failed, see worker log' % source.name
+        except Exception as e:
+            ok, result, error = False, None, str(e)
+        post_json(url + '/jobs/' + job['id'] + '/result', {'ok': ok, 'result': result, 'error': error})
+
+
+class WorkerPool:
+    '''starts the worker blenders and restarts them if they exit'''
+    def __init__(self, blender, count, url, queue):
+        self.blender = blender
+        self.url = url
+        self.queue = queue
+        self.processes = {}
+        for i in range(count):
+            self.start('worker%d' % i)
+
+    def start(self, name):
+        self.processes[name] = subprocess.Popen(
+            [self.blender, '-b', '--factory-startup', '--python', str(Path(__file__).resolve()),
+             '--', 'worker', self.url, '--name', name])
+
+    def monitor(self, interval=1.0):
+        while True:
+            for name, process in list(self.processes.items()):
+                if process.poll() is not None:
+                    log.warning("%s exited with %d, restarting it", name, process.returncode)
+                    self.queue.fail_running(name, "worker exited with %d" % process.returncode)
+                    self.start(name)
+            time.sleep(interval)
+
+    def stop(self):
+        for process in self.processes.values():
+            process.terminate()
+
+
+def serve(blender, workers=2, port=8765):
+    """runs the job api on localhost and a pool of worker blenders until interrupted"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), RequestHandler)
+    server.daemon_threads = True
+    server.queue = JobQueue()
+    url = 'http://127.0.0.1:%d' % server.server_address[1]
+    pool = WorkerPool(blender, workers, url, server.queue)
+    threading.Thread(target=pool.monitor, daemon=True).start()
+    log.info("serving on %s with %d workers", url, workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.stop()
+        server.server_close()
+
+
+def submit(url, source, dest, options=None, wait=False, interval=0.5):
+    """submits a job to the pool at url, returns the job id or, if wait is set, the finished job"""
+    job_id = post_json(url + '/jobs', {'source': str(Path(source).resolve()), 'dest': str(Path(dest).resolve()),
+                                        'options': options or {}})['id']
+    if not wait:
+        return job_id
+    while True:
+        job = get_json(url + '/jobs/' + job_id)
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(interval)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="mixamoserver", description="Pool of background blenders converting mixamo files")
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help="run the job api and the worker pool")
+    serve_parser.add_argument("--blender", default="blender", help="blender executable the workers run in")
+    serve_parser.add_argument("--workers", type=int, default=2, help="number of worker blenders")
+    serve_parser.add_argument("--port", type=int, default=8765, help="port on localhost to serve the api on")
+    worker_parser = commands.add_parser('worker', help="run a worker, only used inside blender by serve")
+    worker_parser.add_argument("url")
+    worker_parser.add_argument("--name", default="worker")
+    submit_parser = commands.add_parser('submit', help="submit a job")
+    submit_parser.add_argument("source", help="file to convert")
+    submit_parser.add_argument("dest", help="folder to write the converted file to")
+    submit_parser.add_argument("--options", help="json file with keyword arguments for batch_hip_to_root")
+    submit_parser.add_argument("--url", default="http://127.0.0.1:8765")
+    submit_parser.add_argument("--wait", action="store_true", help="wait for the job to finish and print it")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'serve':
+        serve(args.blender, args.workers, args.port)
+    elif args.command == 'worker':
+        run_worker(args.url, args.name)
+    else:
+        options = None
+        if args.options is not None:
+            with open(args.options) as options_file:
+                options = json.load(options_file)
+        print(json.dumps(submit(args.url, args.source, args.dest, options, args.wait), indent=1))
+
+
+if __name__ == "__main__":
+    # inside blender the arguments for this script follow '--'
+    main(mixamoheadless.script_args() if 'bpy' in sys.modules else sys.argv[1:])
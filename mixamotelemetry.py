@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Copyright (C) 2017-2021  Enzio Probst
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+# Throughput telemetry of batch conversions, does not need blender.
+
+from pathlib import Path
+import sys
+import json
+import time
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_memory_mb():
+    """peak resident memory of this process in MB, None where it can't be determined"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+class Telemetry:
+    '''times the stages of every converted file and writes a json lines event per file and a summary per run
+
+    event_log: json lines file the per file events are appended to
+    summary_path: json file the run summary is written to
+    prometheus_path: textfile for the prometheus node exporter textfile collector
+    All of them are optional, without any the metrics are only collected in memory.
+    '''
+    def __init__(self, event_log=None, summary_path=None, prometheus_path=None):
+        self.event_log = event_log
+        self.summary_path = summary_path
+        self.prometheus_path = prometheus_path
+        self.run_start = time.time()
+        self.stage_times = {}
+        self.files = 0
+        self.failed = 0
+        self.current = None
+
+    def start_file(self, name):
+        self.current = {'file': str(name), 'start': time.time(), 'stages': {}}
+        self.last_mark = time.perf_counter()
+
+    def stage(self, name):
+        """records the time since the last stage (or the start of the file) under name"""
+        now = time.perf_counter()
+        elapsed = now - self.last_mark
+        self.last_mark = now
+        name = str(name)
+        stages = self.current['stages']
+        stages[name] = stages.get(name, 0.0) + elapsed
+        self.stage_times.setdefault(name, []).append(elapsed)
+
+    def finish_file(self, ok=True, error=None):
+        event = self.current
+        event['ok'] = ok
+        event['error'] = error
+        event['seconds'] = time.time() - event['start']
+        event['peak_memory_mb'] = peak_memory_mb()
+        self.files += 1
+        if not ok:
+            self.failed += 1
+        if self.event_log is not None:
+            with open(self.event_log, 'a') as event_file:
+                event_file.write(json.dumps(event) + '\n')
+        self.current = None
+        return event
+
+    def summary(self):
+        duration = time.time() - self.run_start
+        stages = {}
+        for name, times in self.stage_times.items():
+            times = np.array(times)
+            p50, p90, p99 = np.percentile(times, (50, 90, 99))
+            stages[name] = {'count': len(times), 'total': float(times.sum()),
+                            'p50': float(p50), 'p90': float(p90), 'p99': float(p99), 'max': float(times.max())}
+        converted = self.files - self.failed
+        return {
+            'start': self.run_start,
+            'seconds': duration,
+            'files': self.files,
+            'converted': converted,
+            'failed': self.failed,
+            'failure_rate': self.failed / self.files if self.files else 0.0,
+            'clips_per_minute': converted * 60.0 / duration if duration > 0.0 else 0.0,
+            'peak_memory_mb': peak_memory_mb(),
+            'stages': stages,
+        }
+
+    def finish_run(self):
+        """writes the run summary and the prometheus textfile, returns the summary"""
+        summary = self.summary()
+        if self.summary_path is not None:
+            with open(self.summary_path, 'w') as summary_file:
+                json.dump(summary, summary_file, indent=1)
+        if self.prometheus_path is not None:
+            self.write_prometheus(summary)
+        return summary
+
+    def write_prometheus(self, summary):
+        lines = [
+            '# HELP mixamoconv_files_total Files processed in the last batch run.',
+            '# TYPE mixamoconv_files_total gauge',
+            'mixamoconv_files_total %d' % summary['files'],
+            '# HELP mixamoconv_failed_total Files which failed in the last batch run.',
+            '# TYPE mixamoconv_failed_total gauge',
+            'mixamoconv_failed_total %d' % summary['failed'],
+            '# HELP mixamoconv_clips_per_minute Converted clips per minute in the last batch run.',
+            '# TYPE mixamoconv_clips_per_minute gauge',
+            'mixamoconv_clips_per_minute %f' % summary['clips_per_minute'],
+            '# HELP mixamoconv_run_seconds Duration of the last batch run.',
+            '# TYPE mixamoconv_run_seconds gauge',
+            'mixamoconv_run_seconds %f' % summary['seconds'],
+            '# HELP mixamoconv_stage_seconds Time per stage and file in the last batch run.',
+            '# TYPE mixamoconv_stage_seconds gauge',
+        ]
+        for name, stage in sorted(summary['stages'].items()):
+            label = name.replace('\\', '\\\\').replace('"', '\\"')
+            for quantile in ('p50', 'p90', 'p99'):
+                lines.append('mixamoconv_stage_seconds{stage="%s",quantile="0.%s"} %f' % (label, quantile[1:], stage[quantile]))
+        if summary['peak_memory_mb'] is not None:
+            lines += [
+                '# HELP mixamoconv_peak_memory_megabytes Peak resident memory of the converting process.',
+                '# TYPE mixamoconv_peak_memory_megabytes gauge',
+                'mixamoconv_peak_memory_megabytes %f' % summary['peak_memory_mb'],
+            ]
+        # write and rename so the collector never reads a half written file
+        path = Path(self.prometheus_path)
+        temporary = path.with_name(path.name + '.tmp')
+        with open(temporary, 'w') as prometheus_file:
+            prometheus_file.write('\n'.join(lines) + '\n')
+        temporary.replace(path)
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Copyright (C) 2017-2021  Enzio Probst
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+# Watch folder mode: keeps one background blender running and converts files dropped into a folder.
+#
+#   blender -b --python mixamowatch.py -- <inbox> <outbox> [--options options.json] [--settle 2.0] [--interval 1.0] [--skip-existing]
+#
+# options.json holds keyword arguments for batch_hip_to_root, e.g. {"use_rotation": false, "b_unreal_bones": true}.
+
+from pathlib import Path
+import sys
+import time
+import argparse
+import logging
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import mixamoheadless
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+log = logging.getLogger(__name__)
+
+SOURCE_SUFFIXES = ('.fbx', '.dae', '.zip')
+
+# options collecting results over a whole batch run, every file is a run of its own here
+RUN_OPTIONS = ('write_index', 'deduplicate')
+
+
+class Watcher:
+    '''wakes up on changes in a directory, using inotify if available and polling otherwise'''
+    def __init__(self, directory, interval=1.0):
+        self.interval = interval
+        self.inotify = None
+        if INotify is not None:
+            self.inotify = INotify()
+            self.inotify.add_watch(str(directory), flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.MODIFY)
+
+    def wait(self, timeout):
+        """blocks until something changed in the directory or timeout seconds have passed"""
+        if self.inotify is not None:
+            self.inotify.read(timeout=int(timeout * 1000))
+        else:
+            time.sleep(min(timeout, self.interval))
+
+
+def signature(path):
+    """size and modification time of path, changes while a file is still being copied"""
+    stat = path.stat()
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def check_options(options):
+    """raises ValueError for batch_hip_to_root options which don't work when every file is converted on its own"""
+    for name in RUN_OPTIONS:
+        if options.get(name):
+            raise ValueError("%s is not supported in watch folder mode" % name)
+
+
+def watch(inbox, outbox, options, settle=2.0, interval=1.0, skip_existing=False):
+    """converts new or changed files in inbox to outbox once they stopped changing for settle seconds"""
+    check_options(options)
+    mixamoconv = mixamoheadless.load_addon()
+    inbox = Path(inbox)
+    outbox = Path(outbox)
+    watcher = Watcher(inbox, interval)
+    log.info("watching %s (%s)", inbox, "inotify" if watcher.inotify is not None else "polling")
+
+    converted = {}
+    pending = {}
+    if skip_existing:
+        for path in inbox.iterdir():
+            if path.suffix.lower() in SOURCE_SUFFIXES and path.is_file():
+                converted[path] = signature(path)
+
+    while True:
+        now = time.monotonic()
+        ready = []
+        for path in sorted(inbox.iterdir()):
+            if path.suffix.lower() not in SOURCE_SUFFIXES or not path.is_file():
+                continue
+            try:
+                sig = signature(path)
+            except FileNotFoundError:
+                continue
+            if converted.get(path) == sig:
+                continue
+            seen = pending.get(path)
+            if seen is None or seen[0] != sig:
+                pending[path] = (sig, now)
+            elif now - seen[1] >= settle:
+                ready.append(path)
+
+        for path in ready:
+            sig, _ = pending.pop(path)
+            start = time.monotonic()
+            try:
+                numfiles = mixamoconv.batch_hip_to_root(inbox, outbox, files=[path], **options)
+            except Exception as e:
+                log.exception("converting %s raised %s", path.name, e)
+                numfiles = -1
+            if numfiles == -1:
+                log.error("converting %s failed, waiting for it to change", path.name)
+            else:
+                log.info("converted %s in %.2fs", path.name, time.monotonic() - start)
+            converted[path] = sig
+
+        watcher.wait(settle if pending else interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="mixamowatch", description="Converts mixamo files as they are dropped into a folder")
+    parser.add_argument("inbox", help="folder to watch for fbx, dae and zip files")
+    parser.add_argument("outbox", help="folder converted files are written to")
+    parser.add_argument("--options", help="json file with keyword arguments for batch_hip_to_root")
+    parser.add_argument("--settle", type=float, default=2.0,
+                        help="seconds a file has to stay unchanged before it is converted")
+    parser.add_argument("--interval", type=float, default=1.0, help="polling interval in seconds")
+    parser.add_argument("--skip-existing", action="store_true", help="do not convert files already in the inbox at startup")
+    args = parser.parse_args(mixamoheadless.script_args())
+
+    logging.basicConfig(level=logging.INFO)
+    options = mixamoheadless.load_options(args.options, mixamoheadless.load_addon())
+    try:
+        check_options(options)
+    except ValueError as e:
+        parser.error(str(e))
+    watch(args.inbox, args.outbox, options, settle=args.settle, interval=args.interval, skip_existing=args.skip_existing)
+
+
+if __name__ == "__main__":
+    main()